@@ -0,0 +1,144 @@
+"""
+Batch reconstruction of the inverted abstracts (IA) of papers.
+"""
+from itertools import chain
+import json
+
+import numpy as np
+
+import classes
+
+class AcademicAbstractDecoder(object):
+    """
+    Rebuilds abstracts from their inverted index, {'IndexLength': n,
+    'InvertedIndex': {word: [positions]}}, for many papers at once.
+    texts() scatters the words of each abstract into a list and joins it.
+    tokens() interns the words into a vocabulary shared by every batch
+    decoded with the same decoder, scatters the word id of every position
+    of every abstract into one NumPy array and splits it per paper.
+    Positions missing from an index are left as gaps: -1 tokens, skipped
+    in texts.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.words = []
+
+    @staticmethod
+    def inverted_index(item):
+        """
+        Returns the inverted index of an AcademicPaper, an AcademicPaperMetadata,
+        a raw extended metadata payload (E) given as a JSON string or a dict,
+        or an inverted index itself. Returns None when there is no abstract.
+        """
+        if isinstance(item, classes.AcademicPaper):
+            item = item['E']
+        if item is None:
+            return None
+        if isinstance(item, str):
+            item = json.loads(item)
+        if isinstance(item, classes.AcademicPaperMetadata):
+            return item['IA']
+        if 'InvertedIndex' in item:
+            return item
+        return item.get('IA')
+
+    def tokens(self, items):
+        """
+        Returns, for each item, the int32 array of the word id at each position
+        of its abstract, in the vocabulary of words. Items without an abstract
+        get an empty array.
+        """
+        indexes = [AcademicAbstractDecoder.inverted_index(item) for item in items]
+        flat, lengths = self._scatter(indexes)
+        if not indexes:
+            return []
+        return np.split(flat, np.cumsum(lengths)[:-1])
+
+    def _scatter(self, indexes):
+        """
+        Returns the word ids of every position of the given inverted indexes,
+        concatenated, and the length of each abstract.
+        """
+        keys, values, entries, declared = [], [], [], []
+        for inverted in indexes:
+            if inverted:
+                index = inverted['InvertedIndex']
+                keys.extend(index)
+                values.extend(index.values())
+                entries.append(len(index))
+                declared.append(inverted.get('IndexLength') or 0)
+            else:
+                entries.append(0)
+                declared.append(0)
+        # Words are interned and positions flattened by builtins, not per word
+        vocabulary, words = self.vocabulary, self.words
+        for word in dict.fromkeys(keys):
+            if word not in vocabulary:
+                vocabulary[word] = len(words)
+                words.append(word)
+        word_ids = np.fromiter(map(vocabulary.__getitem__, keys), dtype=np.int32,
+                               count=len(keys))
+        counts = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+        positions = np.fromiter(chain.from_iterable(values), dtype=np.int64,
+                                count=int(counts.sum()))
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        sizes = np.diff(bounds[np.cumsum([0] + entries)])
+        # An index may reach beyond its declared length; the abstract grows to fit
+        lengths = np.array(declared, dtype=np.int64)
+        filled = sizes > 0
+        if filled.any():
+            starts = (np.cumsum(sizes) - sizes)[filled]
+            lengths[filled] = np.maximum(lengths[filled],
+                                         np.maximum.reduceat(positions, starts) + 1)
+        bases = np.cumsum(lengths) - lengths
+        flat = np.full(int(lengths.sum()), -1, dtype=np.int32)
+        flat[positions + np.repeat(bases, sizes)] = np.repeat(word_ids, counts)
+        return flat, lengths
+
+    def texts(self, items):
+        """
+        Returns the abstract of each item as a string, or None for items without one.
+        """
+        return [AcademicAbstractDecoder.text(AcademicAbstractDecoder.inverted_index(item))
+                for item in items]
+
+    @staticmethod
+    def text(inverted):
+        """
+        Returns the abstract of an inverted index as a string, or None.
+        """
+        if not inverted:
+            return None
+        index = inverted['InvertedIndex']
+        words = [None] * (inverted.get('IndexLength') or 0)
+        try:
+            for word, positions in index.items():
+                for position in positions:
+                    words[position] = word
+        except IndexError:
+            # An index may reach beyond its declared length; the abstract grows to fit
+            words.extend([None] * (max(max(positions) for positions in index.values())
+                                   + 1 - len(words)))
+            for word, positions in index.items():
+                for position in positions:
+                    words[position] = word
+        if None in words:
+            words = [word for word in words if word is not None]
+        return ' '.join(words)
+
+    def decode(self, item):
+        """
+        Returns the abstract of one item as a string, or None.
+        """
+        return self.texts([item])[0]
+
+def reconstruct_abstracts(items, tokens=False):
+    """
+    Returns the abstracts of the items as strings, or with tokens as
+    (token arrays, vocabulary words), using a fresh decoder.
+    """
+    decoder = AcademicAbstractDecoder()
+    if tokens:
+        return decoder.tokens(items), decoder.words
+    return decoder.texts(items)
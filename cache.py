@@ -0,0 +1,166 @@
+"""
+Persistent cache for the raw responses of Microsoft's Academic Knowledge API.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+class AcademicCache(object):
+    """
+    An opt-in, on-disk cache of API responses stored in a SQLite database.
+    Entries are keyed on the normalized (endpoint, body) pair of a query,
+    expire after a time-to-live that depends on the endpoint, and the least
+    recently used ones are evicted once the stored bytes exceed max_bytes.
+    The cache is safe to share between threads; several processes can also
+    share the same database file.
+    """
+    DAY = 24 * 60 * 60
+    DEFAULT_TTLS = {
+        'interpret':     7 * DAY,   # pylint: disable-msg=C0326
+        'evaluate':      30 * DAY,  # pylint: disable-msg=C0326
+        'calchistogram': 30 * DAY,  # pylint: disable-msg=C0326
+        'similarity':    365 * DAY, # pylint: disable-msg=C0326
+        'search':        30 * DAY   # pylint: disable-msg=C0326
+    }
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+    def __init__(self, path, max_bytes=None, ttls=None):
+        """
+        Opens (or creates) the cache stored at path.
+        ttls maps endpoint names ('evaluate', 'interpret'...) to seconds;
+        it is merged over DEFAULT_TTLS. A TTL of None never expires.
+        """
+        self.path = path
+        self.max_bytes = max_bytes or self.DEFAULT_MAX_BYTES
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, response TEXT NOT NULL,'
+            ' size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._bytes = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def endpoint(url):
+        """
+        Returns the endpoint name of an API url, e.g. 'evaluate'.
+        """
+        return url.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+
+    @staticmethod
+    def key(url, body):
+        """
+        Returns the cache key of a query, given its url and body.
+        Body values are normalized to strings, as they are sent form-encoded.
+        Bodies already serialized, like the JSON of graph searches, are used as is.
+        """
+        if isinstance(body, str):
+            normalized = body
+        else:
+            normalized = sorted((str(name), str(value)) for name, value in (body or {}).items())
+        payload = json.dumps([url, normalized], separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, url, body):
+        """
+        Returns the cached response text for the query, or None.
+        """
+        key = AcademicCache.key(url, body)
+        ttl = self.ttls.get(AcademicCache.endpoint(url))
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, size, created FROM responses WHERE key=?',
+                                     (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, size, created = row
+            if ttl is not None and created + ttl < now:
+                self._conn.execute('DELETE FROM responses WHERE key=?', (key,))
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE responses SET accessed=? WHERE key=?', (now, key))
+            self.hits += 1
+            return response
+
+    def put(self, url, body, response):
+        """
+        Stores the response text of a query, evicting old entries if needed.
+        """
+        key = AcademicCache.key(url, body)
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute('SELECT size FROM responses WHERE key=?',
+                                          (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, endpoint, response, size, created, accessed)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (key, AcademicCache.endpoint(url), response, size, now, now))
+            self._bytes += size - (previous[0] if previous else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Deletes the least recently used entries until the cache fits in max_bytes.
+        Must be called with the lock held.
+        """
+        self._bytes = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        victims = []
+        for key, size in self._conn.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if self._bytes <= self.max_bytes:
+                break
+            victims.append((key,))
+            self._bytes -= size
+        self._conn.executemany('DELETE FROM responses WHERE key=?', victims)
+        self.evictions += len(victims)
+
+    def stats(self):
+        """
+        Returns the hit/miss/eviction counters and the size of the cache.
+        """
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def clear(self):
+        """
+        Removes every entry of the cache.
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._bytes = 0
+
+    def close(self):
+        """
+        Closes the underlying database.
+        """
+        with self._lock:
+            self._conn.close()
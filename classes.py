@@ -4,7 +4,9 @@ This module provides classes for querying Microsoft's Academic Knowledge API.
 Read more at: https://docs.microsoft.com/en-us/azure/cognitive-services/academic-knowledge
 """
 from enum import Enum
+from types import MappingProxyType
 
+import copy
 import json
 
 class Error(Exception):
@@ -19,6 +21,23 @@ class RequiredArgumentError(Error):
 class QueryTypeError(Error):
     """The query type specified is either not support nor valid."""
 
+class RequestError(Error):
+    """
+    The API answered with an error, or could not be reached.
+    The status code of the last attempt (None when no response was received)
+    and the history of every attempt are kept in the exception.
+    """
+    def __init__(self, msg, status_code=None, history=None):
+        Error.__init__(self, msg)
+        self.status_code = status_code
+        self.history = history or []
+
+class ThrottledError(RequestError):
+    """The API kept throttling (HTTP 429) the request."""
+
+class QuotaExceededError(Error):
+    """The monthly quota configured for the subscription key is exhausted."""
+
 class AcademicEncoder(json.JSONEncoder):
     """
     An extended version of JSONEncoder in order to properly
@@ -42,50 +61,171 @@ class Entities(Enum):
     AFFILIATION = 5
     FIELD_OF_STUDY = 6
 
+class _Missing(object):
+    """
+    Marker for a field deleted from an AcademicObject.
+    It pickles by reference, so it remains a singleton across processes.
+    """
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_MISSING'
+
+    def __repr__(self):
+        return '<missing>'
+
+_MISSING = _Missing()
+
+# Default values of these types are shared by every instance
+_IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes, tuple, frozenset, Enum)
+
+class _Deferred(object):
+    """
+    A raw field value whose decoding is deferred until it is first accessed.
+    The decoder must be a module-level function or a static method,
+    so that deferred values can be pickled.
+    """
+    __slots__ = ('decoder', 'raw')
+
+    def __init__(self, decoder, raw):
+        self.decoder = decoder
+        self.raw = raw
+
+    def resolve(self):
+        """
+        Decodes the raw value.
+        """
+        return self.decoder(self.raw)
+
 class AcademicObject(object):
     """
     An abstract class that is used to define common methods
     for other classes defined for the Microsoft's Academic Knowledge API.
     The class provides basic dictionary-like behavior.
-    """
+    Items can be accessed by attribute name, by MAKA field name or by label.
+    The schema lives once in the class, and instances only hold a list with
+    the value of each field, in schema order. Subclasses must declare
+    `__slots__ = ()` so their instances do not get a __dict__.
+    A field may hold a deferred raw value (see the lazy parsing mode of the
+    parsers), which is decoded and memoized the first time it is read.
+    """
+    __slots__ = ('_values',)
+    # Subclasses map each attribute name to its
+    # (default value, MAKA field name, label, ordering index).
+    # Mutable default values are copied for each instance.
+    FIELDS = {}
+    _field_index = MappingProxyType({})
+    _field_slots = MappingProxyType({})
+    _field_names = ()
+    _new_values = staticmethod(list)
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Builds, once per class, the immutable indexes used to resolve keys and
+        the function creating the values of new instances. The latter copies
+        the list of defaults, and each mutable default, so those are fresh for
+        every instance.
+        """
+        super(AcademicObject, cls).__init_subclass__(**kwargs)
+        fields = sorted(cls.FIELDS.items(), key=lambda item: item[1][3])
+        cls._field_names = tuple(name for name, _ in fields)
+        index = AcademicObject._build_field_index(cls.FIELDS)
+        cls._field_index = MappingProxyType(index)
+        cls._field_slots = MappingProxyType(dict(
+            (key, cls._field_names.index(name)) for key, name in index.items()))
+        cls._new_values = staticmethod(AcademicObject._values_factory(
+            [field[0] for _, field in fields]))
+
+    @staticmethod
+    def _values_factory(defaults):
+        """
+        Returns a function creating a new list of the defaults, in which
+        every mutable default is a shallow copy.
+        """
+        mutable = [(slot, value) for slot, value in enumerate(defaults)
+                   if not isinstance(value, _IMMUTABLE_TYPES)]
+        if not mutable:
+            return defaults.copy
+
+        def new_values():
+            values = defaults.copy()
+            for slot, value in mutable:
+                values[slot] = copy.copy(value)
+            return values
+        return new_values
+
+    @staticmethod
+    def _build_field_index(fields):
+        """
+        Maps every attribute name, MAKA field name and label to the attribute name.
+        Attribute names take precedence over field names, and those over labels.
+        """
+        mapping = {}
+        for position in (None, 1, 2):
+            for name, field in fields.items():
+                mapping.setdefault(name if position is None else field[position], name)
+        return mapping
+
     def __init__(self):
-        self.attrs = {}
+        self._values = self._new_values()
+
+    @classmethod
+    def field_index(cls):
+        """
+        Returns the immutable mapping from every attribute name, MAKA field name
+        and label of the class to the attribute name.
+        """
+        return cls._field_index
+
+    def _resolve_all(self):
+        """
+        Decodes every deferred value of the object.
+        """
+        values = self._values
+        for slot, value in enumerate(values):
+            if value.__class__ is _Deferred:
+                values[slot] = value.resolve()
+        return values
+
+    @property
+    def attrs(self):
+        """
+        A snapshot of the fields in their historical layout:
+        attribute name -> [value, MAKA field name, label, ordering index].
+        Changes made to the snapshot are not reflected in the object.
+        """
+        return dict((name, [value] + list(self.FIELDS[name][1:]))
+                    for name, value in zip(self._field_names, self._resolve_all())
+                    if value is not _MISSING)
 
     def __getitem__(self, key):
-        if key in self.attrs:
-            return self.attrs[key][0]
-        else:
-            for attr in self.attrs:
-                if self.attrs[attr][1] == key:
-                    return self.attrs[attr][0]
-        return None
+        slot = self._field_slots.get(key)
+        if slot is None:
+            return None
+        value = self._values[slot]
+        if value.__class__ is _Deferred:
+            value = self._values[slot] = value.resolve()
+        return None if value is _MISSING else value
 
     def __len__(self):
-        return len(self.attrs)
+        return sum(1 for value in self._values if value is not _MISSING)
 
     def __setitem__(self, key, item):
-        if key in self.attrs:
-            self.attrs[key][0] = item
-        else:
-            for attr in self.attrs:
-                if self.attrs[attr][1] == key:
-                    self.attrs[attr][0] = item
-                    break
-            #self.attrs[key] = [item, key, len(self.attrs)]
+        slot = self._field_slots.get(key)
+        if slot is not None and self._values[slot] is not _MISSING:
+            self._values[slot] = item
 
     def __delitem__(self, key):
-        if key in self.attrs:
-            del self.attrs[key]
-        else:
-            for attr in self.attrs:
-                if self.attrs[attr][1] == key:
-                    del self.attrs[attr]
+        slot = self._field_slots.get(key)
+        if slot is not None:
+            self._values[slot] = _MISSING
 
     def as_dict(self):
         """
         Returns the object as a dictionary.
         """
-        return dict([(key, value[0]) for key, value in self.attrs.items()])
+        return dict((name, value) for name, value in zip(self._field_names, self._resolve_all())
+                    if value is not _MISSING)
 
     def as_json(self, ensure_ascii=True, indent=None, separators=None, sort_keys=False):
         """
@@ -105,351 +245,448 @@ class AcademicPaper(AcademicObject):
     """
     A class representing an article listed on Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'id':             [0,    'Id',  'ID',             0],  # pylint: disable-msg=C0326
-            'title':          [None, 'Ti',  'Title',          1],  # pylint: disable-msg=C0326
-            'authors':        [None, 'AA',  'Authors',        2],  # pylint: disable-msg=C0326
-            'year':           [0,    'Y',   'Year',           3],  # pylint: disable-msg=C0326
-            'date':           [None, 'D',   'Date',           4],  # pylint: disable-msg=C0326
-            'num_citations':  [0,    'CC',  'Nbr of Cites',   5],  # pylint: disable-msg=C0326
-            'cites':          [[],   'Ci',  'Cites',          6],  # pylint: disable-msg=C0326
-            'field_of_study': [None, 'F',   'Field of Study', 7],  # pylint: disable-msg=C0326
-            'journal':        [None, 'J',   'Journal',        8],  # pylint: disable-msg=C0326
-            'conference':     [None, 'C',   'Conference',     9],  # pylint: disable-msg=C0326
-            'references':     [None, 'RId', 'References',     10], # pylint: disable-msg=C0326
-            'excerpt':        [None, 'W',   'Excerpt',        11], # pylint: disable-msg=C0326
-            'metadata':       [None, 'E',   'Metadata',       12]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'id':             (0,    'Id',  'ID',             0),  # pylint: disable-msg=C0326
+        'title':          (None, 'Ti',  'Title',          1),  # pylint: disable-msg=C0326
+        'authors':        (None, 'AA',  'Authors',        2),  # pylint: disable-msg=C0326
+        'year':           (0,    'Y',   'Year',           3),  # pylint: disable-msg=C0326
+        'date':           (None, 'D',   'Date',           4),  # pylint: disable-msg=C0326
+        'num_citations':  (0,    'CC',  'Nbr of Cites',   5),  # pylint: disable-msg=C0326
+        'cites':          ([],   'Ci',  'Cites',          6),  # pylint: disable-msg=C0326
+        'field_of_study': (None, 'F',   'Field of Study', 7),  # pylint: disable-msg=C0326
+        'journal':        (None, 'J',   'Journal',        8),  # pylint: disable-msg=C0326
+        'conference':     (None, 'C',   'Conference',     9),  # pylint: disable-msg=C0326
+        'references':     (None, 'RId', 'References',     10), # pylint: disable-msg=C0326
+        'excerpt':        (None, 'W',   'Excerpt',        11), # pylint: disable-msg=C0326
+        'metadata':       (None, 'E',   'Metadata',       12)  # pylint: disable-msg=C0326
+    }
 
 class AcademicPaperMetadata(AcademicObject):
     """
     A class representing the metadata for articles listed on Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'name':              [None, 'DN',  'Display Name',      0], # pylint: disable-msg=C0326
-            'sources':           [None, 'S',   'Sources',           1], # pylint: disable-msg=C0326
-            'venue':             [None, 'VFN', 'Venue',             2], # pylint: disable-msg=C0326
-            'volume':            [0,    'V',   'Volume',            3], # pylint: disable-msg=C0326
-            'issue':             [0,    'I',   'Issue',             4], # pylint: disable-msg=C0326
-            'first_page':        [None, 'FP',  'First Page',        5], # pylint: disable-msg=C0326
-            'last_page':         [None, 'LP',  'Last Page',         6], # pylint: disable-msg=C0326
-            'doi':               [None, 'DOI', 'Digital Object Id', 7], # pylint: disable-msg=C0326
-            'citation_contexts': [None, 'CC',  'Citation Contexts', 8], # pylint: disable-msg=C0326
-            'inverted_abstract': [None, 'IA',  'Inverted Abstract', 9]  # pylint: disable-msg=C0326
-        }
+    # The (inverted abstract, abstract) last decoded by the abstract property
+    __slots__ = ('_abstract',)
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'name':              (None, 'DN',  'Display Name',      0), # pylint: disable-msg=C0326
+        'sources':           (None, 'S',   'Sources',           1), # pylint: disable-msg=C0326
+        'venue':             (None, 'VFN', 'Venue',             2), # pylint: disable-msg=C0326
+        'volume':            (0,    'V',   'Volume',            3), # pylint: disable-msg=C0326
+        'issue':             (0,    'I',   'Issue',             4), # pylint: disable-msg=C0326
+        'first_page':        (None, 'FP',  'First Page',        5), # pylint: disable-msg=C0326
+        'last_page':         (None, 'LP',  'Last Page',         6), # pylint: disable-msg=C0326
+        'doi':               (None, 'DOI', 'Digital Object Id', 7), # pylint: disable-msg=C0326
+        'citation_contexts': (None, 'CC',  'Citation Contexts', 8), # pylint: disable-msg=C0326
+        'inverted_abstract': (None, 'IA',  'Inverted Abstract', 9)  # pylint: disable-msg=C0326
+    }
+
+    @property
+    def abstract(self):
+        """
+        The abstract rebuilt from the inverted abstract (IA), or None. It is
+        decoded the first time it is read, and again only if IA changes.
+        """
+        inverted = self['IA']
+        memo = getattr(self, '_abstract', None)
+        if memo is None or memo[0] is not inverted:
+            import abstracts # pylint: disable=import-outside-toplevel
+            memo = self._abstract = (inverted, abstracts.AcademicAbstractDecoder.text(inverted))
+        return memo[1]
 
 class AcademicAuthor(AcademicObject):
     """
     A class representing an author retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'id':            [0,    'AuId', 'ID',              0], # pylint: disable-msg=C0326
-            'name':          [None, 'AuN',  'Normalized Name', 1], # pylint: disable-msg=C0326
-            'display_name':  [None, 'DAuN', 'Name',            2], # pylint: disable-msg=C0326
-            'num_citations': [0,    'CC',   'Citations',       3], # pylint: disable-msg=C0326
-            'metadata':      [None, 'E',    'Metadata',        4]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'id':            (0,    'AuId', 'ID',              0), # pylint: disable-msg=C0326
+        'name':          (None, 'AuN',  'Normalized Name', 1), # pylint: disable-msg=C0326
+        'display_name':  (None, 'DAuN', 'Name',            2), # pylint: disable-msg=C0326
+        'num_citations': (0,    'CC',   'Citations',       3), # pylint: disable-msg=C0326
+        'metadata':      (None, 'E',    'Metadata',        4)  # pylint: disable-msg=C0326
+    }
 
 class AcademicAuthorMetadata(AcademicObject):
     """
     A class representing the metadata for authors
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'affiliation': [None, 'LKA', 'Affiliation', 0]
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'affiliation': (None, 'LKA', 'Affiliation', 0)
+    }
 
 class AcademicAffiliation(AcademicObject):
     """
     A class representing an affiliation of authors
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'id':            [0,    'AfId', 'ID',              0], # pylint: disable-msg=C0326
-            'name':          [None, 'AfN',  'Normalized Name', 1], # pylint: disable-msg=C0326
-            'display_name':  [None, 'DAfN', 'Name',            2], # pylint: disable-msg=C0326
-            'num_citations': [0,    'CC',   'Citations',       3], # pylint: disable-msg=C0326
-            'metadata':      [None, 'E',    'Metadata',        4]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'id':            (0,    'AfId', 'ID',              0), # pylint: disable-msg=C0326
+        'name':          (None, 'AfN',  'Normalized Name', 1), # pylint: disable-msg=C0326
+        'display_name':  (None, 'DAfN', 'Name',            2), # pylint: disable-msg=C0326
+        'num_citations': (0,    'CC',   'Citations',       3), # pylint: disable-msg=C0326
+        'metadata':      (None, 'E',    'Metadata',        4)  # pylint: disable-msg=C0326
+    }
 
 class AcademicAffiliationMetadata(AcademicObject):
     """
     A class representing the metadata for an affiliation of authors
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'paper_count': [None, 'PC', 'Paper Count', 0]
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'paper_count': (None, 'PC', 'Paper Count', 0)
+    }
 
 class AcademicFieldOfStudy(AcademicObject):
     """
     A class representing an affiliation of authors
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'id':              [0,    'FId', 'ID',                 0], # pylint: disable-msg=C0326
-            'name':            [None, 'FN',  'Normalized Name',    1], # pylint: disable-msg=C0326
-            'display_name':    [None, 'DFN', 'Name',               2], # pylint: disable-msg=C0326
-            'num_citations':   [0,    'CC',  'Citations',          3], # pylint: disable-msg=C0326
-            'hierarchy_level': [0,    'FL',  'Level in hierarchy', 4], # pylint: disable-msg=C0326
-            'parent':          [None, 'FP',  'Parent',             5], # pylint: disable-msg=C0326
-            'children':        [None, 'FC',  'Children',           6]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'id':              (0,    'FId', 'ID',                 0), # pylint: disable-msg=C0326
+        'name':            (None, 'FN',  'Normalized Name',    1), # pylint: disable-msg=C0326
+        'display_name':    (None, 'DFN', 'Name',               2), # pylint: disable-msg=C0326
+        'num_citations':   (0,    'CC',  'Citations',          3), # pylint: disable-msg=C0326
+        'hierarchy_level': (0,    'FL',  'Level in hierarchy', 4), # pylint: disable-msg=C0326
+        'parent':          (None, 'FP',  'Parent',             5), # pylint: disable-msg=C0326
+        'children':        (None, 'FC',  'Children',           6)  # pylint: disable-msg=C0326
+    }
 
 class AcademicConferenceSeries(AcademicObject):
     """
     A class representing a conference serie
     available at Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'id':             [0,    'Id',  'ID',              0], # pylint: disable-msg=C0326
-            'name':           [None, 'CN',  'Normalized Name', 1], # pylint: disable-msg=C0326
-            'display_name':   [None, 'DCN', 'Name',            2], # pylint: disable-msg=C0326
-            'num_citations':  [0,    'CC',  'Citations',       3], # pylint: disable-msg=C0326
-            'field_of_study': [None, 'F',   'Field of Study',  4]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'id':             (0,    'Id',  'ID',              0), # pylint: disable-msg=C0326
+        'name':           (None, 'CN',  'Normalized Name', 1), # pylint: disable-msg=C0326
+        'display_name':   (None, 'DCN', 'Name',            2), # pylint: disable-msg=C0326
+        'num_citations':  (0,    'CC',  'Citations',       3), # pylint: disable-msg=C0326
+        'field_of_study': (None, 'F',   'Field of Study',  4)  # pylint: disable-msg=C0326
+    }
 
 class AcademicConferenceInstance(AcademicObject):
     """
     A class representing a conference instance
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'id':                [0,    'Id',   'ID',                0], # pylint: disable-msg=C0326
-            'name':              [None, 'CIN',  'Normalized Name',   1], # pylint: disable-msg=C0326
-            'display_name':      [None, 'DCN',  'Name',              2], # pylint: disable-msg=C0326
-            'location':          [None, 'CIL',  'Location',          3], # pylint: disable-msg=C0326
-            'start_date':        [None, 'CISD', 'Start Date',        4], # pylint: disable-msg=C0326
-            'end_date':          [None, 'CIED', 'End Date',          5], # pylint: disable-msg=C0326
-            'conference_series': [None, 'PCS',  'Conference Series', 6], # pylint: disable-msg=C0326
-            'num_citations':     [0,    'CC',   'Citations',         7]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'id':                (0,    'Id',   'ID',                0), # pylint: disable-msg=C0326
+        'name':              (None, 'CIN',  'Normalized Name',   1), # pylint: disable-msg=C0326
+        'display_name':      (None, 'DCN',  'Name',              2), # pylint: disable-msg=C0326
+        'location':          (None, 'CIL',  'Location',          3), # pylint: disable-msg=C0326
+        'start_date':        (None, 'CISD', 'Start Date',        4), # pylint: disable-msg=C0326
+        'end_date':          (None, 'CIED', 'End Date',          5), # pylint: disable-msg=C0326
+        'conference_series': (None, 'PCS',  'Conference Series', 6), # pylint: disable-msg=C0326
+        'num_citations':     (0,    'CC',   'Citations',         7)  # pylint: disable-msg=C0326
+    }
 
 class AcademicConferenceInstanceMetadata(AcademicObject):
     """
     A class representing the metadata for a conference instance
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'full_name': [None, 'FN', 'Full Name', 0]
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'full_name': (None, 'FN', 'Full Name', 0)
+    }
 
 class AcademicJournal(AcademicObject):
     """
     A class representing a journal instance
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'id':                [0,    'Id',   'ID',                0], # pylint: disable-msg=C0326
-            'name':              [None, 'JN',   'Normalized Name',   1], # pylint: disable-msg=C0326
-            'display_name':      [None, 'DJN',  'Name',              2], # pylint: disable-msg=C0326
-            'num_citations':     [0,    'CC',   'Citations',         3]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'id':                (0,    'Id',   'ID',                0), # pylint: disable-msg=C0326
+        'name':              (None, 'JN',   'Normalized Name',   1), # pylint: disable-msg=C0326
+        'display_name':      (None, 'DJN',  'Name',              2), # pylint: disable-msg=C0326
+        'num_citations':     (0,    'CC',   'Citations',         3)  # pylint: disable-msg=C0326
+    }
 
 class AcademicInterpretation(AcademicObject):
     """
     A class representing an interpretation of a query
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'parse': [None, 'parse', 'Parsing Explanation', 0], # pylint: disable-msg=C0326
-            'rules': [None, 'rules', 'Rules',               1]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'parse': (None, 'parse', 'Parsing Explanation', 0), # pylint: disable-msg=C0326
+        'rules': (None, 'rules', 'Rules',               1)  # pylint: disable-msg=C0326
+    }
 
 class AcademicInterpretationRule(AcademicObject):
     """
     A class representing an interpretation's rule for an interpretation
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'name':  [None, 'name',  'Name',  0], # pylint: disable-msg=C0326
-            'type':  [None, 'type',  'Type',  1], # pylint: disable-msg=C0326
-            'value': [None, 'value', 'Value', 2]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'name':  (None, 'name',  'Name',  0), # pylint: disable-msg=C0326
+        'type':  (None, 'type',  'Type',  1), # pylint: disable-msg=C0326
+        'value': (None, 'value', 'Value', 2)  # pylint: disable-msg=C0326
+    }
 
 class AcademicHistogram(AcademicObject):
     """
     A class representing an histogram of an attribute
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'attribute': [None, 'attribute',       'Attribute', 0], # pylint: disable-msg=C0326
-            'values':    [None, 'distinct_values', 'Values',    1], # pylint: disable-msg=C0326
-            'count':     [None, 'total_count',     'Count',     2], # pylint: disable-msg=C0326
-            'data':      [None, 'data',            'Data',      3]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'attribute': (None, 'attribute',       'Attribute', 0), # pylint: disable-msg=C0326
+        'values':    (None, 'distinct_values', 'Values',    1), # pylint: disable-msg=C0326
+        'count':     (None, 'total_count',     'Count',     2), # pylint: disable-msg=C0326
+        'data':      (None, 'data',            'Data',      3)  # pylint: disable-msg=C0326
+    }
 
 class AcademicHistogramValue(AcademicObject):
     """
     A class representing the value of an attribute of an histogram
     retrieved from Microsoft's Academic Knowledge API.
     """
-    def __init__(self):
-        AcademicObject.__init__(self)
-        # The triplets for each keyword correspond to
-        # (0) the actual value,
-        # (1) the field name for MAKA,
-        # (2) a user-suitable label for the item, and
-        # (3) an ordering index.
-        self.attrs = {
-            'value':       [None, 'value', 'Values',      0], # pylint: disable-msg=C0326
-            'probability': [None, 'prob',  'Probability', 1], # pylint: disable-msg=C0326
-            'count':       [None, 'count', 'Count',       2]  # pylint: disable-msg=C0326
-        }
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'value':       (None, 'value', 'Values',      0), # pylint: disable-msg=C0326
+        'probability': (None, 'prob',  'Probability', 1), # pylint: disable-msg=C0326
+        'count':       (None, 'count', 'Count',       2)  # pylint: disable-msg=C0326
+    }
+
+class AcademicGraphPath(AcademicObject):
+    """
+    A class representing a path returned by a graph search
+    on Microsoft's Academic Knowledge API.
+    """
+    __slots__ = ()
+
+    # The entries for each field correspond to
+    # (0) the default value,
+    # (1) the field name for MAKA,
+    # (2) a user-suitable label for the item, and
+    # (3) an ordering index.
+    FIELDS = {
+        'ids':   (None, 'CellID', 'Ids',   0), # pylint: disable-msg=C0326
+        'nodes': (None, 'nodes',  'Nodes', 1)  # pylint: disable-msg=C0326
+    }
 
 class AcademicParser(object):
     """
-    Default parser for Academic objects
+    Default parser for Academic objects.
+    Parsers are compiled once per entity class from its schema into a dispatch
+    table that maps each key of a response (MAKA field name, attribute name or
+    label) straight to a value slot, plus an optional decoder for nested values.
+    Unknown keys are ignored. Subclasses set TARGET to the class they build and
+    DECODERS to the names of their static methods decoding nested fields.
     """
+    TARGET = None
+    DECODERS = {}
+    _generic = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super(AcademicParser, cls).__init_subclass__(**kwargs)
+        if cls.TARGET is not None:
+            decoders = dict((key, getattr(cls, name)) for key, name in cls.DECODERS.items())
+            cls._parser = staticmethod(AcademicParser.compile(cls.TARGET, decoders))
+
+    @staticmethod
+    def compile(target_cls, decoders=None):
+        """
+        Returns a function parse(response, lazy=False) building target_cls objects.
+        decoders maps keys to functions applied to their raw values, whichever
+        key (field name, attribute name or label) the field comes under; in
+        lazy mode the raw values are kept and decoded on first access instead.
+        """
+        slots = target_cls._field_slots
+        slot_decoders = dict((slots[key], decoder) for key, decoder in (decoders or {}).items())
+        table = dict((key, (slot, slot_decoders.get(slot))) for key, slot in slots.items())
+        new_values = target_cls._new_values
+        new = target_cls.__new__
+
+        def parse(response, lazy=False):
+            target = new(target_cls)
+            values = target._values = new_values()
+            for key, value in response.items():
+                entry = table.get(key)
+                if entry is None:
+                    continue
+                slot, decoder = entry
+                if decoder is not None and value is not None:
+                    value = _Deferred(decoder, value) if lazy else decoder(value)
+                values[slot] = value
+            return target
+
+        return parse
+
     @staticmethod
     def _parse(response, cls=None):
-        target = cls()
-        for key in response.keys():
-            value = response[key]
-            target[key] = value
-        return target
+        parse = AcademicParser._generic.get(cls)
+        if parse is None:
+            parse = AcademicParser._generic[cls] = AcademicParser.compile(cls)
+        return parse(response)
+
+    @classmethod
+    def parse_many(cls, responses, lazy=False):
+        """
+        Parses a whole list of responses, e.g. the entities of an evaluate page.
+        """
+        if cls.TARGET is None:
+            parse = cls.parse
+            return [parse(response) for response in responses]
+        parse = cls._parser
+        return [parse(response, lazy) for response in responses]
 
 class AcademicPaperParser(AcademicParser):
     """
-    Parser for AcademicPaper objects
+    Parser for AcademicPaper objects.
+    In lazy mode the authors (AA), fields of study (F) and extended metadata (E)
+    are kept raw and only decoded when they are first accessed.
     """
+    TARGET = AcademicPaper
+    DECODERS = {'AA': 'parse_authors', 'F': 'parse_fields_of_study', 'E': 'parse_metadata'}
+
+    @classmethod
+    def parse(cls, response, lazy=False):
+        return cls._parser(response, lazy)
+
     @staticmethod
-    def parse(response):
-        target = AcademicPaper()
-        for key in response.keys():
-            value = response[key]
-            if key == 'AA':
-                target[key] = [AcademicAuthorParser.parse(author) for author in value]
-            elif key == 'F':
-                target[key] = [AcademicParser._parse(fos, AcademicFieldOfStudy) for fos in value]
-            elif key == 'E':
-                if isinstance(value, str):
-                    value = json.loads(value)
-                target[key] = AcademicParser._parse(value, AcademicPaperMetadata)
-            elif key == 'logprob':
-                continue #ignore
-            else:
-                target[key] = value
-        return target
+    def parse_authors(value):
+        """
+        Parses the list of authors (AA) of a paper.
+        """
+        return AcademicAuthorParser.parse_many(value)
+
+    @staticmethod
+    def parse_fields_of_study(value):
+        """
+        Parses the list of fields of study (F) of a paper.
+        """
+        return [AcademicParser._parse(fos, AcademicFieldOfStudy) for fos in value]
+
+    @staticmethod
+    def parse_metadata(value):
+        """
+        Parses the extended metadata (E) of a paper, given as a JSON string or a dict.
+        """
+        if isinstance(value, str):
+            value = json.loads(value)
+        return AcademicParser._parse(value, AcademicPaperMetadata)
 
 class AcademicAuthorParser(AcademicParser):
     """
     Parser for AcademicAuthor objects
     """
+    TARGET = AcademicAuthor
+    DECODERS = {'E': 'parse_metadata'}
+
+    @classmethod
+    def parse(cls, response, lazy=False):
+        return cls._parser(response, lazy)
+
     @staticmethod
-    def parse(response):
-        target = AcademicAuthor()
-        for key in response.keys():
-            value = response[key]
-            if key == 'FN':
-                target[key] = [AcademicParser._parse(fos, AcademicFieldOfStudy) for fos in value]
-            elif key == 'E':
-                if isinstance(value, str):
-                    value = json.loads(value)
-                target[key] = AcademicParser._parse(value, AcademicPaperMetadata)
-            elif key == 'logprob':
-                continue #ignore
-            else:
-                target[key] = value
-        return target
+    def parse_metadata(value):
+        """
+        Parses the extended metadata (E) of an author, given as a JSON string or a dict.
+        """
+        if isinstance(value, str):
+            value = json.loads(value)
+        return AcademicParser._parse(value, AcademicAuthorMetadata)
 
 class AcademicInterpretationParser(AcademicParser):
     """
@@ -488,3 +725,14 @@ class AcademicHistogramParser(AcademicParser):
         target['data'] = [AcademicParser._parse(val, AcademicHistogramValue)
                           for val in response['histogram']]
         return target
+
+class AcademicGraphPathParser(AcademicParser):
+    """
+    Parser for AcademicGraphPath objects
+    """
+    @staticmethod
+    def parse(response):
+        target = AcademicGraphPath()
+        target['ids'] = [node.get('CellID') for node in response]
+        target['nodes'] = response
+        return target
@@ -0,0 +1,183 @@
+"""
+Columnar (NumPy) representation of parsed papers, for analytics.
+"""
+import struct
+import zipfile
+
+from array import array
+
+import numpy as np
+import numpy.lib.format as npformat
+
+import classes
+
+class AcademicColumns(object):
+    """
+    A table of papers stored as NumPy columns:
+
+    * typed columns: id (int64), year (int32), num_citations (int64)
+      and date (datetime64[D], NaT when missing);
+    * ragged columns, stored as <name>.offsets (n + 1 int64 boundaries)
+      and <name>.values: authors (AuId), fields (FId) and references (RId);
+    * dictionary-encoded strings, stored as <name>.codes (int32, -1 when
+      missing) and <name>.dictionary: title, journal (JN) and conference (CN).
+      author_names and field_names hold the codes of the names of the authors
+      and fields, aligned with the values of their ragged columns.
+    """
+    RAGGED = ('authors', 'fields', 'references')
+    STRINGS = ('title', 'journal', 'conference', 'author_names', 'field_names')
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.arrays['id'])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @staticmethod
+    def from_papers(papers):
+        """
+        Builds the columns from an iterable of AcademicPaper objects, in one pass.
+        """
+        ids, years, citations, dates = array('q'), array('i'), array('q'), []
+        ragged = dict((name, (array('q', [0]), array('q'))) for name in AcademicColumns.RAGGED)
+        strings = dict((name, ({}, array('i'))) for name in AcademicColumns.STRINGS)
+
+        def encode(name, value):
+            dictionary, codes = strings[name]
+            if value is None:
+                codes.append(-1)
+            else:
+                codes.append(dictionary.setdefault(value, len(dictionary)))
+
+        def extend(name, values):
+            offsets, flat = ragged[name]
+            flat.extend(values)
+            offsets.append(len(flat))
+
+        for paper in papers:
+            ids.append(paper['Id'] or 0)
+            years.append(paper['Y'] or 0)
+            citations.append(paper['CC'] or 0)
+            dates.append(paper['D'] or 'NaT')
+            encode('title', paper['Ti'])
+            encode('journal', AcademicColumns._member(paper['J'], 'JN'))
+            encode('conference', AcademicColumns._member(paper['C'], 'CN'))
+            authors = paper['AA'] or []
+            extend('authors', [author['AuId'] or 0 for author in authors])
+            for author in authors:
+                encode('author_names', author['AuN'])
+            fields = paper['F'] or []
+            extend('fields', [field['FId'] or 0 for field in fields])
+            for field in fields:
+                encode('field_names', field['FN'])
+            extend('references', paper['RId'] or [])
+
+        arrays = {
+            'id': np.frombuffer(ids, dtype=np.int64).copy(),
+            'year': np.frombuffer(years, dtype=np.int32).copy(),
+            'num_citations': np.frombuffer(citations, dtype=np.int64).copy(),
+            'date': np.array(dates, dtype='datetime64[D]')
+        }
+        for name, (offsets, flat) in ragged.items():
+            arrays[name + '.offsets'] = np.frombuffer(offsets, dtype=np.int64).copy()
+            arrays[name + '.values'] = np.frombuffer(flat, dtype=np.int64).copy()
+        for name, (dictionary, codes) in strings.items():
+            arrays[name + '.codes'] = np.frombuffer(codes, dtype=np.int32).copy()
+            arrays[name + '.dictionary'] = np.array(list(dictionary), dtype=np.str_)
+        return AcademicColumns(arrays)
+
+    @staticmethod
+    def _member(value, key):
+        """
+        Returns value[key] for a raw dict or an AcademicObject, None otherwise.
+        """
+        if isinstance(value, dict):
+            return value.get(key)
+        if isinstance(value, classes.AcademicObject):
+            return value[key]
+        return None
+
+    def ragged(self, name, row):
+        """
+        Returns the values of a ragged column for one row.
+        """
+        offsets = self.arrays[name + '.offsets']
+        return self.arrays[name + '.values'][offsets[row]:offsets[row + 1]]
+
+    def lengths(self, name):
+        """
+        Returns the number of values of a ragged column in each row.
+        """
+        return np.diff(self.arrays[name + '.offsets'])
+
+    def strings(self, name):
+        """
+        Decodes a dictionary-encoded column into an array of strings ('' when missing).
+        """
+        codes = self.arrays[name + '.codes']
+        dictionary = np.append(self.arrays[name + '.dictionary'], '')
+        return dictionary[codes]
+
+    def group_by(self, key, value=None):
+        """
+        Returns (distinct keys, per-key sum of the value column), or the
+        per-key row counts when no value column is given.
+        """
+        keys, inverse = np.unique(self.arrays[key], return_inverse=True)
+        weights = None if value is None else self.arrays[value]
+        return keys, np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+
+    def citations_per_year(self):
+        """
+        Returns (years, total citations of the papers published each year).
+        """
+        years, totals = self.group_by('year', 'num_citations')
+        return years, totals.astype(np.int64)
+
+    def save(self, path, compressed=False):
+        """
+        Saves the columns into an .npz file. Only uncompressed files
+        can be memory-mapped when they are loaded back.
+        """
+        (np.savez_compressed if compressed else np.savez)(path, **self.arrays)
+
+    @staticmethod
+    def load(path, mmap_mode=None):
+        """
+        Loads columns saved with save(). With mmap_mode ('r', 'r+' or 'c'),
+        the columns of an uncompressed file are memory-mapped, not read.
+        """
+        if mmap_mode is None:
+            with np.load(path) as archive:
+                return AcademicColumns(dict((name, archive[name]) for name in archive.files))
+        return AcademicColumns(AcademicColumns._map_npz(path, mmap_mode))
+
+    @staticmethod
+    def _map_npz(path, mmap_mode):
+        """
+        Memory-maps every member of an uncompressed .npz file.
+        """
+        arrays = {}
+        with zipfile.ZipFile(path) as archive, open(path, 'rb') as handle:
+            for info in archive.infolist():
+                if info.compress_type != zipfile.ZIP_STORED:
+                    raise classes.FormatError('Compressed .npz files cannot be memory-mapped')
+                # skip the local file header to reach the .npy payload
+                handle.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack('<HH', handle.read(4))
+                handle.seek(info.header_offset + 30 + name_length + extra_length)
+                version = npformat.read_magic(handle)
+                if version == (1, 0):
+                    shape, fortran, dtype = npformat.read_array_header_1_0(handle)
+                else:
+                    shape, fortran, dtype = npformat.read_array_header_2_0(handle)
+                name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+                if not np.prod(shape, dtype=np.int64):
+                    arrays[name] = np.zeros(shape, dtype=dtype)
+                    continue
+                arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=handle.tell(),
+                                         shape=shape, order='F' if fortran else 'C')
+        return arrays
@@ -0,0 +1,458 @@
+"""
+Crawl engine expanding queries into papers and their citing papers.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+
+import classes
+import inquirer
+
+class AcademicCrawlTask(object):
+    """
+    A unit of work of a crawl: the kind of the rule handling it, the query
+    payload, the id of the paper it expands (if any), its depth in citation
+    hops from the papers of the seeds, and its scheduling priority.
+    The crawler numbers the tasks it schedules.
+    """
+    __slots__ = ('kind', 'payload', 'parent', 'depth', 'priority', 'id')
+
+    def __init__(self, kind, payload, parent=None, depth=0, priority=0):
+        self.kind = kind
+        self.payload = payload
+        self.parent = parent
+        self.depth = depth
+        self.priority = priority
+        self.id = None
+
+    def as_dict(self):
+        """
+        Returns the task as a JSON-serializable dict.
+        """
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @staticmethod
+    def from_dict(values):
+        """
+        Builds a task from the output of as_dict().
+        """
+        task = AcademicCrawlTask(values['kind'], values['payload'], values['parent'],
+                                 values['depth'], values['priority'])
+        task.id = values['id']
+        return task
+
+    def __repr__(self):
+        return 'AcademicCrawlTask({!r}, {!r}, parent={!r}, depth={})'.format(
+            self.kind, self.payload, self.parent, self.depth)
+
+def _resolve(waiter):
+    """
+    Wakes up a pop_async() waiting on a future, unless it was cancelled.
+    """
+    if not waiter.done():
+        waiter.set_result(None)
+
+class AcademicFrontier(object):
+    """
+    A thread-safe priority queue of crawl tasks, highest priority first
+    and first-in first-out among equal priorities.
+    Like queue.Queue, it counts unfinished tasks so join() returns once every
+    pushed task was marked done. Once closed, pop() returns None.
+    Coroutines can wait on it with pop_async(), which parks a future of
+    their event loop instead of a thread: a cancelled wait leaves the
+    frontier untouched.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._unfinished = 0
+        self._closed = False
+        self._waiters = []
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap)
+
+    def push(self, task):
+        """
+        Schedules a task.
+        """
+        with self._condition:
+            if self._closed:
+                raise classes.Error('The frontier is closed')
+            heapq.heappush(self._heap, (-task.priority, next(self._counter), task))
+            self._unfinished += 1
+            self._condition.notify_all()
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        """
+        Resolves the futures of the waiting pop_async(), from any thread.
+        Must be called with the lock held.
+        """
+        for loop, waiter in self._waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:
+                # the loop of the waiter is already closed
+                pass
+        self._waiters = []
+
+    def pop(self, timeout=None):
+        """
+        Returns the task with the highest priority, waiting for one if needed.
+        Returns None once the frontier is closed, or when the timeout expires.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._heap or self._closed, timeout):
+                return None
+            if not self._heap:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    async def pop_async(self):
+        """
+        Waits for the task with the highest priority without blocking the event loop.
+        Returns None once the frontier is closed.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            with self._condition:
+                if self._heap:
+                    return heapq.heappop(self._heap)[2]
+                if self._closed:
+                    return None
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self._condition:
+                    if (loop, waiter) in self._waiters:
+                        self._waiters.remove((loop, waiter))
+
+    def task_done(self):
+        """
+        Marks a popped task as processed.
+        """
+        with self._condition:
+            self._unfinished -= 1
+            self._condition.notify_all()
+
+    def join(self):
+        """
+        Waits until every pushed task was marked done.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._unfinished <= 0)
+
+    def close(self):
+        """
+        Wakes up every waiting pop(), which then return None.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            self._wake_waiters()
+
+class AcademicCrawlRule(object):
+    """
+    Base class of the expansion rules of a crawler.
+    A rule handles the tasks of one KIND: expand() sends the queries of a task,
+    hands the (parent id, entity) pairs found to AcademicCrawler.record(),
+    which keeps only the entities not seen yet, and returns the follow-up tasks.
+    """
+    KIND = None
+
+    def expand(self, crawler, task):
+        """
+        Processes a task and returns the list of tasks it leads to.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def citation_tasks(crawler, papers, depth):
+        """
+        Returns the tasks looking up the papers citing papers, in batches of
+        AcademicConf.MAX_EXPR_TERMS. Most cited papers are batched together
+        first, and each batch is prioritized by its most cited paper.
+        """
+        papers = sorted(papers, key=lambda paper: paper['CC'] or 0, reverse=True)
+        size = crawler.batcher.max_terms
+        tasks = []
+        for start in range(0, len(papers), size):
+            batch = papers[start:start + size]
+            tasks.append(AcademicCrawlTask('citations', {'ids': [paper['Id'] for paper in batch]},
+                                           depth=depth, priority=batch[0]['CC'] or 0))
+        return tasks
+
+class InterpretRule(AcademicCrawlRule):
+    """
+    Interprets a natural language query, payload {'query': ...}, and
+    schedules the evaluation of its interpretations.
+    """
+    KIND = 'interpret'
+
+    def expand(self, crawler, task):
+        querier = inquirer.AcademicQuerier(inquirer.AcademicQueryType.INTERPRET, task.payload,
+                                           session=crawler.session, cache=crawler.cache)
+        exprs = [interpretation['rules'][0]['value'] for interpretation in querier.post()]
+        return [AcademicCrawlTask('evaluate', {'expr': expr}, task.parent, task.depth,
+                                  task.priority)
+                for expr in crawler.batcher.expressions(exprs)]
+
+class EvaluateRule(AcademicCrawlRule):
+    """
+    Evaluates an expression, payload {'expr': ...}, records every matching
+    paper and schedules the lookup of the papers citing the new ones.
+    Every full page is checkpointed with the offset of the next one in the
+    payload, so a resumed crawl does not ask for the same page twice.
+    """
+    KIND = 'evaluate'
+
+    def expand(self, crawler, task):
+        querier = inquirer.AcademicQuerier(inquirer.AcademicQueryType.EVALUATE, {
+            'expr': task.payload['expr'],
+            'attributes': crawler.attributes
+        }, session=crawler.session, cache=crawler.cache)
+        page_size = inquirer.AcademicConf.MAX_PAGE_RESULTS
+        offset = task.payload.get('offset', 0)
+        while True:
+            results = crawler.post(querier.page(offset, page_size))
+            papers = crawler.record(task, [(task.parent, paper) for paper in results])
+            follow_ups = self.citation_tasks(crawler, papers, task.depth + 1)
+            if len(results) < page_size:
+                return follow_ups
+            offset += len(results)
+            crawler.checkpoint(task, follow_ups, dict(task.payload, offset=offset))
+
+class CitationsRule(AcademicCrawlRule):
+    """
+    Looks up the papers citing a batch of papers, payload {'ids': [...]},
+    records them and schedules the lookup of their own citing papers.
+    """
+    KIND = 'citations'
+
+    def expand(self, crawler, task):
+        citations = crawler.batcher.lookup('RId', task.payload['ids'])
+        papers = crawler.record(task, [(parent, paper) for parent, found in citations.items()
+                                       for paper in found])
+        return self.citation_tasks(crawler, papers, task.depth + 1)
+
+class AcademicCrawler(object):
+    """
+    Crawls papers with a pool of worker threads pulling tasks from a
+    priority frontier. Papers are deduplicated by Id in a hash set, and a
+    parent -> children index keeps every citation found, so each result
+    costs O(1) whatever the size of the crawl. Tasks deeper than max_depth
+    citation hops are dropped. The default rules go interpret -> evaluate
+    -> citing papers; other rules can be given, keyed by their KIND.
+    With an AcademicCrawlJournal, the progress of every task is journaled
+    once it is done (or checkpointed), and resume() picks an interrupted
+    crawl up from the journal. Entities found by tasks which failed, or
+    were still running at the time of the interruption, are found, and
+    handed to on_entity, again. With an AcademicParsePipeline, evaluate pages are
+    parsed in its worker processes.
+    """
+    DEFAULT_RULES = (InterpretRule, EvaluateRule, CitationsRule)
+
+    def __init__(self, rules=None, max_depth=1, workers=None, attributes='*', on_entity=None,
+                 session=None, cache=None, batcher=None, journal=None, pipeline=None,
+                 pre_commit=None):
+        """
+        on_entity(entity, task), if given, is called once for each new entity,
+        from the worker thread which found it. pre_commit(), if given, is
+        called before each journal record, and must make whatever on_entity
+        stored so far durable (e.g. flush the writers): once journaled,
+        entities are never handed to on_entity again, even after resume().
+        """
+        rules = rules if rules is not None else [rule() for rule in self.DEFAULT_RULES]
+        self.rules = dict((rule.KIND, rule) for rule in rules)
+        self.max_depth = max_depth
+        self.workers = workers or inquirer.AcademicConf.MAX_WORKERS
+        self.attributes = attributes
+        self.on_entity = on_entity
+        self.session = session
+        self.cache = cache
+        self.batcher = batcher or inquirer.AcademicExpressionBatcher(
+            attributes, session=session, cache=cache)
+        self.frontier = AcademicFrontier()
+        self.seen = set()
+        self.children = {}
+        self.errors = []
+        self.journal = journal
+        self.pipeline = pipeline
+        self.pre_commit = pre_commit
+        self._next_id = 0
+        self._unjournaled = {}
+        self._lock = threading.Lock()
+
+    def post(self, querier):
+        """
+        Sends a query and returns its parsed results, through the pipeline if any.
+        """
+        if self.pipeline is not None:
+            return self.pipeline.post(querier)
+        return querier.post()
+
+    def schedule(self, task):
+        """
+        Pushes a task to the frontier, unless it is deeper than max_depth.
+        Returns whether the task was scheduled.
+        """
+        if task.kind not in self.rules:
+            raise classes.QueryTypeError('No rule for tasks of kind {}'.format(task.kind))
+        return bool(self._commit(None, [task]))
+
+    def checkpoint(self, task, follow_ups, payload):
+        """
+        Schedules the follow-up tasks of a task still running and saves its
+        updated payload, journaling them along with the entities it recorded so far.
+        """
+        self._commit(task, follow_ups, payload)
+        task.payload = payload
+
+    def _commit(self, task, follow_ups, payload=None, done=False):
+        """
+        Numbers and journals the follow-up tasks not deeper than max_depth,
+        then pushes them to the frontier. Returns the tasks scheduled.
+        """
+        follow_ups = [follow_up for follow_up in follow_ups
+                      if self.max_depth is None or follow_up.depth <= self.max_depth]
+        if self.journal is not None and self.pre_commit is not None:
+            self.pre_commit()
+        with self._lock:
+            for follow_up in follow_ups:
+                follow_up.id = self._next_id
+                self._next_id += 1
+            if self.journal is not None:
+                task_id = None if task is None else task.id
+                pairs, _ = self._unjournaled.pop(task_id, ([], []))
+                self.journal.append(task_id, pairs, [follow_up.as_dict() for follow_up in follow_ups],
+                                    payload, done)
+                if self.journal.needs_compaction():
+                    self._compact()
+        for follow_up in follow_ups:
+            self.frontier.push(follow_up)
+        return follow_ups
+
+    def _compact(self):
+        """
+        Snapshots the journaled part of the state. Must be called with the lock held.
+        """
+        seen, children = self.seen, self.children
+        if self._unjournaled:
+            seen = set(seen)
+            children = dict((parent, set(ids)) for parent, ids in children.items())
+            for pairs, new in self._unjournaled.values():
+                seen.difference_update(new)
+                for parent, child in pairs:
+                    if parent in children:
+                        children[parent].discard(child)
+        self.journal.compact(seen, children, self._next_id)
+
+    def _rollback(self, task_id):
+        """
+        Forgets the ids and citations recorded by a failed task since its last
+        journal record, so that its retry finds them again. Must be called with
+        the lock held.
+        """
+        pairs, new = self._unjournaled.pop(task_id, ([], []))
+        self.seen.difference_update(new)
+        for parent, child in pairs:
+            if parent is not None and parent in self.children:
+                self.children[parent].discard(child)
+                if not self.children[parent]:
+                    del self.children[parent]
+
+    def resume(self):
+        """
+        Restores the seen ids, the citation index and the pending tasks saved
+        in the journal, and returns how many tasks were pushed back to the frontier.
+        """
+        state = self.journal.load()
+        with self._lock:
+            self.seen = state['seen']
+            self.children = state['children']
+            self._next_id = state['next_id']
+        tasks = [AcademicCrawlTask.from_dict(values) for _, values in sorted(state['tasks'].items())]
+        for task in tasks:
+            self.frontier.push(task)
+        return len(tasks)
+
+    def record(self, task, pairs):
+        """
+        Indexes the (parent id, entity) pairs found by a task and returns the
+        entities which were not seen before, after handing them to on_entity.
+        """
+        new = []
+        with self._lock:
+            for parent, entity in pairs:
+                entity_id = entity['Id']
+                if parent is not None:
+                    self.children.setdefault(parent, set()).add(entity_id)
+                if entity_id not in self.seen:
+                    self.seen.add(entity_id)
+                    new.append(entity)
+            if self.journal is not None:
+                pairs_found, new_ids = self._unjournaled.setdefault(task.id, ([], []))
+                pairs_found.extend((parent, entity['Id']) for parent, entity in pairs)
+                new_ids.extend(entity['Id'] for entity in new)
+        if self.on_entity is not None:
+            for entity in new:
+                self.on_entity(entity, task)
+        return new
+
+    def _work(self):
+        while True:
+            task = self.frontier.pop()
+            if task is None:
+                return
+            try:
+                self._commit(task, self.rules[task.kind].expand(self, task), done=True)
+            except Exception as error: # pylint: disable=broad-except
+                inquirer.AcademicUtils.log('error', 'Task {} failed: {}'.format(task, error))
+                with self._lock:
+                    # Left pending in the journal, to be retried on resume
+                    self._rollback(task.id)
+                    self.errors.append((task, error))
+            finally:
+                self.frontier.task_done()
+
+    def run(self, seeds):
+        """
+        Crawls from the seed tasks until the frontier is exhausted.
+        Failed tasks are logged and kept with their error in errors.
+        The journal, if any, is compacted at the end.
+        """
+        for task in seeds:
+            self.schedule(task)
+        threads = [threading.Thread(target=self._work) for _ in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self.frontier.join()
+        self.frontier.close()
+        for thread in threads:
+            thread.join()
+        if self.journal is not None:
+            with self._lock:
+                self._compact()
+            self.journal.close()
+        return self.stats()
+
+    def stats(self):
+        """
+        Returns the counters of the crawl.
+        """
+        with self._lock:
+            return {
+                'entities': len(self.seen),
+                'parents': len(self.children),
+                'citations': sum(len(children) for children in self.children.values()),
+                'pending': len(self.frontier),
+                'errors': len(self.errors)
+            }
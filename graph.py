@@ -0,0 +1,261 @@
+"""
+Local citation graph built from the references (RId) of parsed papers.
+"""
+from array import array
+
+import numpy as np
+
+import classes
+
+class AcademicCitationGraph(object):
+    """
+    A citation graph over paper ids, stored as NumPy compressed sparse rows.
+    Node ids are kept sorted in `nodes` and addressed by their position;
+    the out-adjacency (paper -> papers it references) and the in-adjacency
+    (paper -> papers citing it) are both kept, as (indptr, indices) pairs,
+    so degrees and neighborhoods are cheap in both directions.
+    Duplicate edges are dropped.
+    """
+    DIRECTIONS = ('out', 'in', 'both')
+
+    def __init__(self, nodes, out_indptr, out_indices, in_indptr, in_indices):
+        self.nodes = nodes
+        self.out_indptr = out_indptr
+        self.out_indices = out_indices
+        self.in_indptr = in_indptr
+        self.in_indices = in_indices
+
+    @staticmethod
+    def from_edges(citing, cited):
+        """
+        Builds the graph from two aligned sequences of paper ids: citing[i] cites cited[i].
+        """
+        citing = np.asarray(citing, dtype=np.int64)
+        cited = np.asarray(cited, dtype=np.int64)
+        nodes, inverse = np.unique(np.concatenate([citing, cited]), return_inverse=True)
+        inverse = inverse.ravel()
+        source, target = inverse[:len(citing)], inverse[len(citing):]
+        edges = np.unique(source * len(nodes) + target)
+        source, target = edges // max(len(nodes), 1), edges % max(len(nodes), 1)
+        out_indptr, out_indices = AcademicCitationGraph._compress(source, target, len(nodes))
+        in_indptr, in_indices = AcademicCitationGraph._compress(target, source, len(nodes))
+        return AcademicCitationGraph(nodes, out_indptr, out_indices, in_indptr, in_indices)
+
+    @staticmethod
+    def from_papers(papers):
+        """
+        Builds the graph from an iterable of AcademicPaper objects.
+        Besides the references (RId) of each paper, the papers citing it listed
+        in its `cites` attribute become edges. They may be papers, dicts (e.g.
+        read back with storage.AcademicJsonlReader) or ids. Crawls index the
+        citing papers apart, see from_children().
+        """
+        citing, cited = array('q'), array('q')
+        for paper in papers:
+            paper_id = paper['Id']
+            references = paper['RId'] or []
+            citing.extend([paper_id] * len(references))
+            cited.extend(references)
+            for citer in paper['cites'] or []:
+                if isinstance(citer, classes.AcademicObject):
+                    citer = citer['Id']
+                elif isinstance(citer, dict):
+                    citer = citer['id'] if 'id' in citer else citer.get('Id')
+                if citer:
+                    citing.append(citer)
+                    cited.append(paper_id)
+        return AcademicCitationGraph.from_edges(np.frombuffer(citing, dtype=np.int64),
+                                                np.frombuffer(cited, dtype=np.int64))
+
+    @staticmethod
+    def from_children(children):
+        """
+        Builds the graph from the index of citing papers of a crawl, mapping
+        each paper id to the ids of the papers citing it: AcademicCrawler.children
+        or the cites.json written by samples/author.py, keyed by strings.
+        """
+        citing, cited = array('q'), array('q')
+        for parent, ids in children.items():
+            ids = list(ids)
+            citing.extend(ids)
+            cited.extend([int(parent)] * len(ids))
+        return AcademicCitationGraph.from_edges(np.frombuffer(citing, dtype=np.int64),
+                                                np.frombuffer(cited, dtype=np.int64))
+
+    @staticmethod
+    def from_columns(columns):
+        """
+        Builds the graph from the references of an AcademicColumns table.
+        """
+        citing = np.repeat(columns['id'], columns.lengths('references'))
+        return AcademicCitationGraph.from_edges(citing, columns['references.values'])
+
+    @staticmethod
+    def _compress(rows, columns, size):
+        """
+        Returns the (indptr, indices) of the sparse rows given by the edge lists.
+        """
+        order = np.argsort(rows, kind='stable')
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+        return indptr, columns[order]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, paper_id):
+        return self.positions([paper_id])[0] >= 0
+
+    @property
+    def num_edges(self):
+        """
+        The number of distinct citations in the graph.
+        """
+        return len(self.out_indices)
+
+    def positions(self, ids):
+        """
+        Returns the positions of paper ids among the nodes, -1 for unknown ids.
+        """
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if not len(self.nodes):
+            return np.full(len(ids), -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.nodes, ids), len(self.nodes) - 1)
+        return np.where(self.nodes[found] == ids, found, -1)
+
+    def _adjacency(self, direction):
+        if direction == 'out':
+            return self.out_indptr, self.out_indices
+        if direction == 'in':
+            return self.in_indptr, self.in_indices
+        raise classes.FormatError('direction must be one of {}'.format(self.DIRECTIONS))
+
+    @staticmethod
+    def _gather(indptr, indices, positions):
+        """
+        Returns the concatenated neighbors of the nodes at positions, vectorized.
+        """
+        starts = indptr[positions]
+        lengths = indptr[positions + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.zeros(0, dtype=np.int64)
+        shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return indices[shifts + np.arange(total)]
+
+    def _known(self, ids):
+        positions = self.positions(ids)
+        return positions[positions >= 0]
+
+    def out_degree(self, ids=None):
+        """
+        Returns the number of references of each paper (of every node by default).
+        Unknown ids have a degree of 0.
+        """
+        return self._degree(self.out_indptr, ids)
+
+    def in_degree(self, ids=None):
+        """
+        Returns the number of citations of each paper (of every node by default).
+        Unknown ids have a degree of 0.
+        """
+        return self._degree(self.in_indptr, ids)
+
+    def _degree(self, indptr, ids):
+        degrees = np.diff(indptr)
+        if ids is None:
+            return degrees
+        positions = self.positions(ids)
+        return np.where(positions >= 0, degrees[np.maximum(positions, 0)] if len(degrees)
+                        else 0, 0)
+
+    def references(self, paper_id):
+        """
+        Returns the ids of the papers cited by a paper.
+        """
+        indptr, indices = self._adjacency('out')
+        return self.nodes[self._gather(indptr, indices, self._known([paper_id]))]
+
+    def citations(self, paper_id):
+        """
+        Returns the ids of the papers citing a paper.
+        """
+        indptr, indices = self._adjacency('in')
+        return self.nodes[self._gather(indptr, indices, self._known([paper_id]))]
+
+    def neighborhood(self, ids, hops=1, direction='out'):
+        """
+        Returns the sorted ids of the papers reachable from ids within `hops`
+        steps, following references ('out'), citations ('in') or both.
+        The starting papers are included.
+        """
+        if direction not in self.DIRECTIONS:
+            raise classes.FormatError('direction must be one of {}'.format(self.DIRECTIONS))
+        adjacencies = [self._adjacency(way) for way in
+                       (('out', 'in') if direction == 'both' else (direction,))]
+        seen = np.zeros(len(self.nodes), dtype=bool)
+        frontier = np.unique(self._known(ids))
+        seen[frontier] = True
+        for _ in range(hops):
+            if not len(frontier):
+                break
+            reached = np.concatenate([self._gather(indptr, indices, frontier)
+                                      for indptr, indices in adjacencies])
+            reached = np.unique(reached)
+            frontier = reached[~seen[reached]]
+            seen[frontier] = True
+        return self.nodes[seen]
+
+    def co_citation(self, first, second):
+        """
+        Returns how many papers cite both papers.
+        """
+        return len(np.intersect1d(self.citations(first), self.citations(second)))
+
+    def bibliographic_coupling(self, first, second):
+        """
+        Returns how many references both papers share.
+        """
+        return len(np.intersect1d(self.references(first), self.references(second)))
+
+    def co_citation_counts(self, paper_id):
+        """
+        Returns (ids, counts) of the papers co-cited with a paper,
+        i.e. cited along with it, and by how many papers.
+        """
+        return self._two_step(paper_id, 'in', 'out')
+
+    def bibliographic_coupling_counts(self, paper_id):
+        """
+        Returns (ids, counts) of the papers sharing references with a paper,
+        and how many references they share.
+        """
+        return self._two_step(paper_id, 'out', 'in')
+
+    def _two_step(self, paper_id, first, second):
+        positions = self._known([paper_id])
+        middle = self._gather(*(self._adjacency(first) + (positions,)))
+        reached = self._gather(*(self._adjacency(second) + (middle,)))
+        reached = reached[~np.isin(reached, positions)]
+        found, counts = np.unique(reached, return_counts=True)
+        return self.nodes[found], counts
+
+    def save(self, path):
+        """
+        Saves the graph into an .npz file.
+        """
+        np.savez(path, nodes=self.nodes, out_indptr=self.out_indptr,
+                 out_indices=self.out_indices, in_indptr=self.in_indptr,
+                 in_indices=self.in_indices)
+
+    @staticmethod
+    def load(path, mmap_mode=None):
+        """
+        Loads a graph saved with save(), memory-mapping it if mmap_mode is given.
+        """
+        if mmap_mode is not None:
+            from columnar import AcademicColumns
+            arrays = AcademicColumns.load(path, mmap_mode).arrays
+            return AcademicCitationGraph(**arrays)
+        with np.load(path) as archive:
+            return AcademicCitationGraph(**dict((name, archive[name]) for name in archive.files))
@@ -0,0 +1,283 @@
+"""
+Histograms of many expressions, merged into NumPy count tables, and
+histograms computed locally over papers already fetched.
+"""
+import csv
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import classes
+import columnar
+import inquirer
+
+# The column of AcademicColumns holding each attribute, and the ragged
+# column its values are aligned with (None for one value per paper)
+COLUMN_ATTRIBUTES = {
+    'Id': ('id', None),
+    'Y': ('year', None),
+    'CC': ('num_citations', None),
+    'D': ('date', None),
+    'Ti': ('title', None),
+    'J.JN': ('journal', None),
+    'C.CN': ('conference', None),
+    'AA.AuId': ('authors', 'authors'),
+    'AA.AuN': ('author_names', 'authors'),
+    'F.FId': ('fields', 'fields'),
+    'F.FN': ('field_names', 'fields'),
+    'RId': ('references', 'references')
+}
+# Attributes whose missing values parsed papers and columns hold as 0
+ZERO_MISSING = ('Id', 'Y', 'AA.AuId', 'F.FId')
+
+class AcademicHistogramTable(object):
+    """
+    The histograms of one attribute for many expressions, merged into an
+    (expressions x values) int64 matrix of counts. A value missing from the
+    histogram of an expression, e.g. because it was not among its `count`
+    most frequent values, counts 0 there. totals holds the total_count of
+    each expression, which normalize() divides by.
+    """
+
+    def __init__(self, attribute, expressions, values, counts, totals=None):
+        self.attribute = attribute
+        self.expressions = list(expressions)
+        self.values = np.asarray(values)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        if totals is None:
+            totals = self.counts.sum(axis=1)
+        self.totals = np.asarray(totals, dtype=np.int64)
+        self._rows = dict((expr, row) for row, expr in enumerate(self.expressions))
+
+    @staticmethod
+    def from_histograms(attribute, expressions, histograms):
+        """
+        Builds the table of an attribute from the AcademicHistogram of each
+        expression, or None for expressions without one.
+        """
+        rows, values, counts, totals = [], [], [], []
+        for row, histogram in enumerate(histograms):
+            if histogram is None:
+                totals.append(0)
+                continue
+            totals.append(histogram['count'] or 0)
+            for value in histogram['data'] or []:
+                rows.append(row)
+                values.append(value['value'])
+                counts.append(value['count'] or 0)
+        values = np.array(values)
+        if values.dtype == object:
+            values = values.astype(np.str_)
+        distinct, columns = np.unique(values, return_inverse=True)
+        shape = (len(totals), len(distinct))
+        cells = np.ravel_multi_index((np.array(rows, dtype=np.int64), columns.ravel()), shape)
+        merged = np.bincount(cells, weights=np.array(counts, dtype=np.float64),
+                             minlength=shape[0] * shape[1])
+        return AcademicHistogramTable(attribute, expressions, distinct,
+                                      merged.astype(np.int64).reshape(shape), totals)
+
+    def row(self, expression):
+        """
+        Returns the counts of the values for one expression.
+        """
+        return self.counts[self._rows[expression]]
+
+    def sum(self, expressions=None):
+        """
+        Returns the counts of the values summed across the given expressions, or all of them.
+        """
+        if expressions is None:
+            return self.counts.sum(axis=0)
+        return self.counts[[self._rows[expr] for expr in expressions]].sum(axis=0)
+
+    def normalize(self):
+        """
+        Returns the float64 probabilities of the values for each expression,
+        i.e. the counts divided by its total_count. Empty expressions are all 0.
+        """
+        totals = self.totals.astype(np.float64)[:, np.newaxis]
+        return np.divide(self.counts, totals, out=np.zeros(self.counts.shape), where=totals > 0)
+
+    def top(self, k, expression=None):
+        """
+        Returns the k (value, count) pairs with the highest counts, for one
+        expression or summed across all of them. Ties keep the value order.
+        """
+        counts = self.sum() if expression is None else self.row(expression)
+        best = np.argsort(-counts, kind='stable')[:k]
+        best = best[counts[best] > 0]
+        return list(zip(self.values[best].tolist(), counts[best].tolist()))
+
+    def to_csv(self, path):
+        """
+        Writes the non-zero counts, one (expression, value, count, probability) row each.
+        """
+        probabilities = self.normalize()
+        rows, columns = np.nonzero(self.counts)
+        with open(path, 'w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(['expr', self.attribute, 'count', 'prob'])
+            for row, column in zip(rows.tolist(), columns.tolist()):
+                writer.writerow([self.expressions[row], self.values[column].item(),
+                                 int(self.counts[row, column]), probabilities[row, column]])
+
+    def save(self, path):
+        """
+        Saves the table into an .npz file.
+        """
+        np.savez(path, attribute=np.array(self.attribute),
+                 expressions=np.array(self.expressions, dtype=np.str_),
+                 values=self.values, counts=self.counts, totals=self.totals)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a table saved with save().
+        """
+        with np.load(path) as archive:
+            return AcademicHistogramTable(archive['attribute'].item(),
+                                          archive['expressions'].tolist(), archive['values'],
+                                          archive['counts'], archive['totals'])
+
+class AcademicHistogramEngine(object):
+    """
+    Sends the calchistogram queries of many expressions concurrently, by up
+    to `concurrency` threads (AcademicConf.MAX_WORKERS by default) within the
+    rate limit of the session, and merges their histograms into one
+    AcademicHistogramTable per attribute. count is the number of most
+    frequent values returned for each expression and attribute.
+    """
+
+    def __init__(self, attributes, count=None, session=None, cache=None, concurrency=None):
+        self.attributes = attributes if isinstance(attributes, str) else ','.join(attributes)
+        self.count = count or inquirer.AcademicConf.MAX_PAGE_RESULTS
+        self.session = session
+        self.cache = cache
+        self.concurrency = concurrency or inquirer.AcademicConf.MAX_WORKERS
+        self.requests_sent = 0
+        self._lock = threading.Lock()
+
+    def _request(self, expr):
+        querier = inquirer.AcademicQuerier(inquirer.AcademicQueryType.HISTOGRAM, {
+            'expr': expr,
+            'attributes': self.attributes,
+            'count': self.count
+        }, session=self.session, cache=self.cache)
+        histograms = querier.post()
+        with self._lock:
+            self.requests_sent += 1
+        return histograms
+
+    def histograms(self, expressions):
+        """
+        Returns the list of AcademicHistogram of each expression, in order.
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(self._request, expressions))
+
+    def run(self, expressions):
+        """
+        Returns the AcademicHistogramTable of each attribute, keyed by attribute.
+        Duplicated expressions are only sent once.
+        """
+        expressions = list(dict.fromkeys(expressions))
+        results = [dict((histogram['attribute'], histogram) for histogram in histograms)
+                   for histograms in self.histograms(expressions)]
+        attributes = [attribute.strip() for attribute in self.attributes.split(',')]
+        return dict((attribute, AcademicHistogramTable.from_histograms(
+            attribute, expressions, [found.get(attribute) for found in results]))
+                    for attribute in attributes)
+
+def _paper_values(entities, attribute):
+    """
+    Returns the (row, value) pairs of an attribute, e.g. Y or F.FN, of parsed
+    papers or raw entities, as two lists.
+    """
+    top, _, nested = attribute.partition('.')
+    missing = (None, 0) if attribute in ZERO_MISSING else (None,)
+    rows, values = [], []
+    for row, entity in enumerate(entities):
+        value = columnar.AcademicColumns._member(entity, top)
+        if value is None:
+            continue
+        members = value if isinstance(value, list) else [value]
+        if nested:
+            members = [columnar.AcademicColumns._member(member, nested) for member in members]
+        for member in members:
+            if member not in missing:
+                rows.append(row)
+                values.append(member)
+    return rows, values
+
+def _column_values(columns, attribute):
+    """
+    Returns the (row, value) pairs of an attribute of AcademicColumns, as two
+    arrays, and the dictionary of the values when they are string codes.
+    Missing values are left out: -1 codes, NaT dates and the 0 of ZERO_MISSING.
+    """
+    if attribute not in COLUMN_ATTRIBUTES:
+        raise classes.FormatError('Attribute {} is not stored in columns, use one of {}'
+                                  .format(attribute, sorted(COLUMN_ATTRIBUTES)))
+    name, ragged = COLUMN_ATTRIBUTES[attribute]
+    if ragged is None:
+        rows = np.arange(len(columns))
+    else:
+        rows = np.repeat(np.arange(len(columns)), columns.lengths(ragged))
+    if name in columnar.AcademicColumns.STRINGS:
+        codes = columns[name + '.codes']
+        present = codes >= 0
+        return rows[present], codes[present], columns[name + '.dictionary']
+    values = columns[name + '.values' if ragged is not None else name]
+    if name == 'date':
+        present = ~np.isnat(values)
+        return rows[present], values[present].astype(np.str_), None
+    if attribute in ZERO_MISSING:
+        present = values != 0
+        return rows[present], values[present], None
+    return rows, values, None
+
+def calc_histogram(entities, attributes, count=None):
+    """
+    Computes locally what the calchistogram endpoint returns for the given
+    papers: the list of AcademicHistogram of the attributes (a comma-separated
+    string or a list, nested ones like F.FN included), each with the number
+    of distinct values, their total count and its `count` most frequent
+    values (all by default). A value counts each paper having it once, and
+    its probability is its share of the total count. entities are parsed
+    papers, raw evaluate entities or AcademicColumns; with columns the
+    grouping runs on the arrays, without building a Python object per value.
+    """
+    if isinstance(attributes, str):
+        attributes = [attribute.strip() for attribute in attributes.split(',')]
+    if not isinstance(entities, columnar.AcademicColumns):
+        entities = list(entities)
+    histograms = []
+    for attribute in attributes:
+        dictionary = None
+        if isinstance(entities, columnar.AcademicColumns):
+            rows, values, dictionary = _column_values(entities, attribute)
+        else:
+            rows, values = _paper_values(entities, attribute)
+        rows, values = np.asarray(rows, dtype=np.int64), np.asarray(values)
+        distinct, codes = np.unique(values, return_inverse=True)
+        if dictionary is not None:
+            # Strings are grouped by code, and sorted like the decoded ones
+            order = np.argsort(dictionary[distinct], kind='stable')
+            distinct = dictionary[distinct][order]
+            codes = np.argsort(order)[codes]
+        # A paper having a value several times counts once
+        cells = np.unique(rows * len(distinct) + codes.ravel())
+        counts = np.bincount(cells % max(len(distinct), 1), minlength=len(distinct))
+        total = int(counts.sum())
+        order = np.argsort(-counts, kind='stable')[:count]
+        histograms.append(classes.AcademicHistogramParser.parse({
+            'attribute': attribute,
+            'distinct_values': len(distinct),
+            'total_count': total,
+            'histogram': [{'value': value, 'prob': found / float(total), 'count': found}
+                          for value, found in zip(distinct[order].tolist(),
+                                                  counts[order].tolist())]
+        }))
+    return histograms
@@ -4,12 +4,26 @@ Microsoft Academic Knowledge site
 """
 from enum import Enum
 
+import asyncio
+import copy
+import json
 import os
 import sys
+import threading
+import time
 
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None # pylint: disable-msg=C0103
 
 import classes
+from ratelimit import AcademicRateLimiter, AcademicRetryPolicy
+from streaming import AcademicJSONStream
 
 # Support unicode in both Python 2 and 3. In Python 3, unicode is str.
 if sys.version_info[0] == 3:
@@ -30,8 +44,30 @@ class AcademicConf(object):
     VERSION = 'latest'
     LOG_LEVEL = int(os.getenv('LOG_LEVEL', 1))
     MAX_PAGE_RESULTS = 50
+    MAX_WORKERS = int(os.getenv('MAKA_MAX_WORKERS', 8))
+    # A single-valued attribute present on every paper, used to count matches
+    COUNT_ATTRIBUTE = 'Y'
     BASE_URL = 'https://westus.api.cognitive.microsoft.com/academic/v1.0'
     USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:27.0) Gecko/20100101 Firefox/27.0'
+    POOL_CONNECTIONS = int(os.getenv('MAKA_POOL_CONNECTIONS', 4))
+    POOL_MAXSIZE = int(os.getenv('MAKA_POOL_MAXSIZE', 16))
+    POOL_BLOCK = False
+    ASYNC_POOL_LIMIT = int(os.getenv('MAKA_ASYNC_POOL_LIMIT', 100))
+    ASYNC_CONCURRENCY = int(os.getenv('MAKA_ASYNC_CONCURRENCY', 100))
+    CALLS_PER_SECOND = float(os.getenv('MAKA_CALLS_PER_SECOND', 0))
+    CALLS_PER_MONTH = int(os.getenv('MAKA_CALLS_PER_MONTH', 0))
+    RATE_STATE_DIR = os.getenv('MAKA_RATE_STATE_DIR', None)
+    MAX_RETRIES = int(os.getenv('MAKA_MAX_RETRIES', 5))
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 60.0
+    # An AcademicCache used by every querier created without an explicit one
+    CACHE = None
+    # Whether evaluate results defer decoding nested fields until first access
+    LAZY_PARSING = False
+    STREAM_CHUNK_SIZE = 64 * 1024
+    # Limits of the OR(...) expressions packed by AcademicExpressionBatcher
+    MAX_EXPR_TERMS = int(os.getenv('MAKA_MAX_EXPR_TERMS', 50))
+    MAX_EXPR_LENGTH = int(os.getenv('MAKA_MAX_EXPR_LENGTH', 2048))
 
 class AcademicUtils(object):
     """A wrapper for various utensils that come in handy."""
@@ -54,6 +90,29 @@ class AcademicUtils(object):
         except ValueError:
             raise classes.FormatError(msg)
 
+    @staticmethod
+    def rate_limiter(subscription_key):
+        """
+        Returns the rate limiter shared by everyone using the subscription key.
+        """
+        return AcademicRateLimiter.for_key(
+            subscription_key,
+            calls_per_second=AcademicConf.CALLS_PER_SECOND,
+            calls_per_month=AcademicConf.CALLS_PER_MONTH,
+            state_dir=AcademicConf.RATE_STATE_DIR
+        )
+
+    @staticmethod
+    def retry_policy():
+        """
+        Returns a retry policy built from the global settings.
+        """
+        return AcademicRetryPolicy(
+            max_retries=AcademicConf.MAX_RETRIES,
+            backoff_base=AcademicConf.BACKOFF_BASE,
+            backoff_max=AcademicConf.BACKOFF_MAX
+        )
+
     @staticmethod
     def log(level, msg):
         """
@@ -67,6 +126,118 @@ class AcademicUtils(object):
         sys.stderr.write('[%5s]  %s' % (level.upper(), msg + '\n'))
         sys.stderr.flush()
 
+class AcademicSession(object):
+    """
+    A thread-safe transport shared by every querier.
+    It wraps a requests.Session whose adapter keeps per-host connection
+    pools alive between calls, so the TCP/TLS handshake is paid once per
+    pooled connection instead of once per query. The headers (including
+    the subscription key) are built only once, when the session is created.
+    Every call waits on the rate limiter of the subscription key, and
+    transient failures are retried following the session's retry policy.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, subscription_key=None, pool_connections=None,
+                 pool_maxsize=None, pool_block=None, limiter=None, retry_policy=None):
+        if subscription_key is None:
+            subscription_key = os.getenv('MAKA_SUBSCRIPTION_KEY', None)
+        if subscription_key is None:
+            raise KeyError('MAKA_SUBSCRIPTION_KEY')
+        self.subscription_key = subscription_key
+        self.headers = {
+            'user-agent': AcademicConf.USER_AGENT,
+            'Ocp-Apim-Subscription-Key': subscription_key
+        }
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections or AcademicConf.POOL_CONNECTIONS,
+            pool_maxsize=pool_maxsize or AcademicConf.POOL_MAXSIZE,
+            pool_block=AcademicConf.POOL_BLOCK if pool_block is None else pool_block
+        )
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.limiter = limiter or AcademicUtils.rate_limiter(subscription_key)
+        self.retry_policy = retry_policy or AcademicUtils.retry_policy()
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @classmethod
+    def get_shared(cls):
+        """
+        Returns the session shared by all the queriers, creating it on first use.
+        """
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def configure(cls, **kwargs):
+        """
+        Replaces the shared session with a new one built from kwargs.
+        The previous session, if any, is closed.
+        """
+        with cls._shared_lock:
+            previous = cls._shared
+            cls._shared = cls(**kwargs)
+        if previous is not None:
+            previous.close()
+        return cls._shared
+
+    def post(self, url, data=None, **kwargs):
+        """
+        Sends a POST request through the pooled connections.
+        """
+        with self._lock:
+            self.requests_sent += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return self.session.post(url, data=data, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self):
+        """
+        Returns the usage counters of the session and its connection pools.
+        """
+        pools = {}
+        poolmanager = self.adapter.poolmanager
+        for key in list(poolmanager.pools.keys()):
+            pool = poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools['{}://{}:{}'.format(pool.scheme, pool.host, pool.port)] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests
+            }
+        with self._lock:
+            return {
+                'requests': self.requests_sent,
+                'failures': self.failures,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'pools': pools
+            }
+
+    def close(self):
+        """
+        Closes every pooled connection.
+        """
+        self.session.close()
+
 class AcademicQueryType(Enum): # pylint: disable=too-few-public-methods
     """
     Enumeration for the types of queries existing in MAKA
@@ -98,6 +269,13 @@ class AcademicQuery(object):
         """
         return None
 
+    def get_headers(self):
+        """
+        Returns the extra HTTP headers needed to submit the body of this
+        query, or None when the default form encoding applies.
+        """
+        return None
+
     def _add_attribute_type(self, key, label, default_value=None):
         """
         Adds a new type of attribute to the list of attributes
@@ -343,18 +521,97 @@ class CalcHistogramQuery(EvaluateQuery):
     def get_url(self):
         return self.CALC_HISTOGRAM_URL
 
+class GraphSearchQuery(AcademicQuery):
+    """
+    This class represents a query to the graph search endpoint.
+    The body is a JSON object holding the path pattern and, for each node
+    variable of the path, its constraints and the attributes to select.
+    The service returns every matching path at once, so count and offset
+    are applied on the client and are not part of the body.
+    """
+    GRAPH_SEARCH_URL = AcademicConf.BASE_URL + '/graph/search?mode=json'
+
+    def __init__(self, path=None, nodes=None):
+        AcademicQuery.__init__(self)
+        self.path = path
+        self.nodes = nodes or {}
+        self.count = AcademicConf.MAX_PAGE_RESULTS
+        self.offset = 0
+
+    def set_path(self, value):
+        """
+        Sets the path pattern, e.g. '/paper/AuthorIDs/author'.
+        """
+        self.path = value
+
+    def set_nodes(self, value):
+        """
+        Sets the constraints of the node variables of the path, e.g.
+        {'author': {'type': 'Author', 'Name': 'bin shao'}}.
+        """
+        self.nodes = value or {}
+
+    def set_count(self, value):
+        """
+        Sets the maximum number of paths to return.
+        """
+        msg = 'count must be numeric'
+        self.count = AcademicUtils.ensure_int(value, msg)
+
+    def set_offset(self, value):
+        """
+        Sets the index of the first path to return.
+        """
+        msg = 'offset must be numeric'
+        self.offset = AcademicUtils.ensure_int(value, msg)
+
+    def get_url(self):
+        return self.GRAPH_SEARCH_URL
+
+    def get_headers(self):
+        return {'Content-Type': 'application/json'}
+
+    def get_body(self):
+        """
+        Creates and returns the JSON body for the POST request
+        """
+        if self.path is None:
+            raise classes.RequiredArgumentError('Graph search needs a path')
+        if 'path' in self.nodes:
+            raise classes.FormatError('path is not a valid node variable name')
+
+        args = dict(self.nodes)
+        args['path'] = self.path
+
+        return json.dumps(args, sort_keys=True, separators=(',', ':'))
+
 class AcademicQuerier(object):
     """
     Class in charge of making the requests to the Microsoft's Academic
     Knowledge site.
     """
 
-    def __init__(self, query_type, arguments=None):
+    def __init__(self, query_type, arguments=None, session=None, cache=None, lazy=None):
         """
         Constructor that receives the type of query and a set of arguments
-        to pass to the query
+        to pass to the query. Unless a session is given, the querier
+        uses the pooled session shared by every querier.
+        Responses are looked up in and stored to the given AcademicCache,
+        or AcademicConf.CACHE when none is given. With lazy parsing (which
+        defaults to AcademicConf.LAZY_PARSING), the authors, fields of study
+        and metadata of papers are only decoded when first accessed.
         """
         self.query_type = query_type
+        self.session = session
+        self.cache = cache
+        self.lazy = AcademicConf.LAZY_PARSING if lazy is None else lazy
+        self.query = AcademicQuerier.build_query(query_type, arguments)
+
+    @staticmethod
+    def build_query(query_type, arguments=None):
+        """
+        Builds the query object for the given type of query and arguments.
+        """
         # step 1: parameters sanity check
         if not isinstance(query_type, AcademicQueryType):
             raise classes.QueryTypeError('Query type must be of type AcademicQueryType.')
@@ -362,62 +619,723 @@ class AcademicQuerier(object):
             arguments = {}
 
         # step 2: build the query
-        self.query = None
+        query = None
         if query_type == AcademicQueryType.INTERPRET:
-            self.query = InterpretQuery()
-            self.query.set_query(arguments.get('query', self.query.query))
-            self.query.set_complete(arguments.get('complete', self.query.complete))
-            self.query.set_count(arguments.get('count', self.query.count))
-            self.query.set_offset(arguments.get('offset', self.query.offset))
-            self.query.set_timeout(arguments.get('timeout', self.query.timeout))
-            self.query.set_model(arguments.get('model', self.query.model))
+            query = InterpretQuery()
+            query.set_query(arguments.get('query', query.query))
+            query.set_complete(arguments.get('complete', query.complete))
+            query.set_count(arguments.get('count', query.count))
+            query.set_offset(arguments.get('offset', query.offset))
+            query.set_timeout(arguments.get('timeout', query.timeout))
+            query.set_model(arguments.get('model', query.model))
         elif query_type == AcademicQueryType.EVALUATE:
-            self.query = EvaluateQuery()
-            self.query.set_expr(arguments.get('expr', self.query.expr))
-            self.query.set_attributes(arguments.get('attributes', self.query.attributes))
-            self.query.set_count(arguments.get('count', self.query.count))
-            self.query.set_offset(arguments.get('offset', self.query.offset))
-            self.query.set_model(arguments.get('model', self.query.model))
+            query = EvaluateQuery()
+            query.set_expr(arguments.get('expr', query.expr))
+            query.set_attributes(arguments.get('attributes', query.attributes))
+            query.set_count(arguments.get('count', query.count))
+            query.set_offset(arguments.get('offset', query.offset))
+            query.set_model(arguments.get('model', query.model))
         elif query_type == AcademicQueryType.SIMILARITY:
-            self.query = SimilarityQuery()
-            self.query.set_s1(arguments.get('s1', self.query.s1))
-            self.query.set_s2(arguments.get('s2', self.query.s2))
+            query = SimilarityQuery()
+            query.set_s1(arguments.get('s1', query.s1))
+            query.set_s2(arguments.get('s2', query.s2))
         elif query_type == AcademicQueryType.HISTOGRAM:
-            self.query = CalcHistogramQuery()
-            self.query.set_expr(arguments.get('expr', self.query.expr))
-            self.query.set_attributes(arguments.get('attributes', self.query.attributes))
-            self.query.set_count(arguments.get('count', self.query.count))
-            self.query.set_offset(arguments.get('offset', self.query.offset))
-            self.query.set_model(arguments.get('model', self.query.model))
+            query = CalcHistogramQuery()
+            query.set_expr(arguments.get('expr', query.expr))
+            query.set_attributes(arguments.get('attributes', query.attributes))
+            query.set_count(arguments.get('count', query.count))
+            query.set_offset(arguments.get('offset', query.offset))
+            query.set_model(arguments.get('model', query.model))
+        elif query_type == AcademicQueryType.GRAPH_TRAVERSAL:
+            query = GraphSearchQuery()
+            query.set_path(arguments.get('path', query.path))
+            query.set_nodes(arguments.get('nodes', query.nodes))
+            query.set_count(arguments.get('count', query.count))
+            query.set_offset(arguments.get('offset', query.offset))
         else:
             raise classes.QueryTypeError('Query type not supported.')
+        return query
+
+    @staticmethod
+    def parse_response(query_type, status_code, text, lazy=False):
+        """
+        Turns the raw response of the API into Academic objects.
+        """
+        if status_code >= 300:
+            raise classes.RequestError('An error ocurred while processing the request. Code: {}'
+                                       .format(status_code), status_code)
+        if query_type == AcademicQueryType.INTERPRET:
+            jobject = json.loads(text)
+            return [classes.AcademicInterpretationParser.parse(interpretation)
+                    for interpretation in jobject['interpretations']]
+        elif query_type == AcademicQueryType.EVALUATE:
+            jobject = json.loads(text)
+            return classes.AcademicPaperParser.parse_many(jobject['entities'], lazy)
+        elif query_type == AcademicQueryType.SIMILARITY:
+            return float(text)
+        elif query_type == AcademicQueryType.HISTOGRAM:
+            jobject = json.loads(text)
+            return [classes.AcademicHistogramParser.parse(entity)
+                    for entity in jobject['histograms']]
+        elif query_type == AcademicQueryType.GRAPH_TRAVERSAL:
+            jobject = json.loads(text)
+            return [classes.AcademicGraphPathParser.parse(path) for path in jobject['Results']]
+        return None
+
+    @staticmethod
+    def paginate(query_type, query, results):
+        """
+        Applies the count and offset of a graph search, which the service
+        does not paginate, to its parsed paths. Other results are returned as is.
+        """
+        if query_type == AcademicQueryType.GRAPH_TRAVERSAL:
+            return results[query.offset:query.offset + query.count]
+        return results
 
     def post(self):
-        if os.getenv('MAKA_SUBSCRIPTION_KEY', None) is None:
-             raise KeyError('MAKA_SUBSCRIPTION_KEY')
-        headers = {
+        """
+        Sends the query and returns the parsed results.
+        """
+        results = AcademicQuerier.parse_response(self.query_type, 200, self.fetch(), self.lazy)
+        return AcademicQuerier.paginate(self.query_type, self.query, results)
+
+    def fetch(self):
+        """
+        Sends the query and returns the raw text of the successful response.
+        """
+        cache = self.cache or AcademicConf.CACHE
+        url = self.query.get_url()
+        data = self.query.get_body()
+        if cache is not None:
+            text = cache.get(url, data)
+            if text is not None:
+                return text
+        the_request = self._send(url, data, headers=self.query.get_headers())
+        AcademicUtils.log('debug', 'Received {} ({} bytes)'.format(url, len(the_request.content)))
+        text = the_request.text
+        if cache is not None:
+            cache.put(url, data, text)
+        return text
+
+    def _send(self, url, data, stream=False, headers=None):
+        """
+        Sends the request within the rate limit, retrying transient failures,
+        and returns the successful response. With stream, the body of the
+        response is left unread.
+        """
+        session = self.session or AcademicSession.get_shared()
+        history = []
+        while True:
+            session.limiter.acquire()
+            AcademicUtils.log('debug', 'Sending {}/{}'.format(url, data))
+            try:
+                the_request = session.post(url, data=data, stream=stream, headers=headers)
+            except requests.RequestException as error:
+                delay = session.retry_policy.next_delay(history, None, reason=str(error))
+            else:
+                if the_request.status_code < 300:
+                    return the_request
+                the_request.close()
+                retry_after = AcademicRetryPolicy.parse_retry_after(
+                    the_request.headers.get('Retry-After'))
+                delay = session.retry_policy.next_delay(history, the_request.status_code,
+                                                        retry_after, the_request.reason)
+            AcademicUtils.log('warn', 'Retrying {} in {:.2f}s'.format(url, delay))
+            time.sleep(delay)
+
+    def stream(self, chunk_size=None):
+        """
+        Sends an evaluate or histogram query and yields the parsed papers or
+        histograms one by one, as soon as each element of the response is
+        complete, instead of decoding the whole body first. Memory is bounded
+        by one element, not one page. Streamed responses bypass the cache.
+        """
+        if self.query_type == AcademicQueryType.EVALUATE:
+            key = 'entities'
+            parse = lambda entity: classes.AcademicPaperParser.parse(entity, self.lazy)
+        elif self.query_type == AcademicQueryType.HISTOGRAM:
+            key = 'histograms'
+            parse = classes.AcademicHistogramParser.parse
+        else:
+            raise classes.QueryTypeError('Only evaluate and histogram queries can be streamed.')
+        url = self.query.get_url()
+        the_request = self._send(url, self.query.get_body(), stream=True)
+        try:
+            chunks = the_request.iter_content(chunk_size or AcademicConf.STREAM_CHUNK_SIZE)
+            for element in AcademicJSONStream(chunks).iter_array(key):
+                yield parse(element)
+        finally:
+            the_request.close()
+
+    def page(self, offset, count):
+        """
+        Returns a copy of this querier asking for `count` results from `offset`.
+        """
+        querier = copy.copy(self)
+        querier.query = copy.copy(self.query)
+        querier.query.set_offset(offset)
+        querier.query.set_count(count)
+        return querier
+
+    def iter_entities(self, page_size=None, max_results=None, prefetch=True):
+        """
+        Yields every entity matching an evaluate query, walking the offsets
+        in pages of page_size (AcademicConf.MAX_PAGE_RESULTS by default)
+        from the offset of the query. Iteration stops on the first short page,
+        or once max_results entities were yielded. While the caller consumes
+        a page, the next one is fetched in the background unless prefetch is off.
+        """
+        if self.query_type != AcademicQueryType.EVALUATE:
+            raise classes.QueryTypeError('Only evaluate queries can be paginated.')
+        page_size = AcademicUtils.ensure_int(page_size or AcademicConf.MAX_PAGE_RESULTS,
+                                             'page_size must be numeric')
+        offset = self.query.offset
+        remaining = max_results
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+        def request(offset, count):
+            querier = self.page(offset, count)
+            if executor is None:
+                return querier
+            return executor.submit(querier.post)
+
+        try:
+            count = page_size if remaining is None else min(page_size, remaining)
+            pending = request(offset, count) if count > 0 else None
+            while pending is not None:
+                results = pending.post() if executor is None else pending.result()
+                if remaining is not None:
+                    results = results[:remaining]
+                    remaining -= len(results)
+                offset += count
+                pending = None
+                if len(results) >= count and (remaining is None or remaining > 0):
+                    count = page_size if remaining is None else min(page_size, remaining)
+                    pending = request(offset, count)
+                for result in results:
+                    yield result
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def count_entities(self, attribute=None):
+        """
+        Returns how many entities match the expression of an evaluate query,
+        as reported by the total_count of a calchistogram on the attribute.
+        """
+        querier = AcademicQuerier(AcademicQueryType.HISTOGRAM, {
+            'expr': self.query.expr,
+            'attributes': attribute or AcademicConf.COUNT_ATTRIBUTE,
+            'count': 1,
+            'model': self.query.model
+        }, session=self.session, cache=self.cache)
+        histograms = querier.post()
+        return histograms[0]['count'] or 0 if histograms else 0
+
+    @staticmethod
+    def plan_pages(start, page_size, total=None, max_results=None, last=None):
+        """
+        Plans the (offset, count) pages of an evaluate query fetched in full,
+        returned as a list. The first batch covers the matches from start up
+        to the `total` of the whole query, with at least one page. Each page asks for page_size
+        entities, so an exact count ends on a short page. The next batches
+        follow the (offset, count, returned) of the last page of the previous
+        one: one more page when it came back full, because the count was
+        stale, and none after a short or empty page. max_results caps the
+        number of entities from start.
+        """
+
+        def page(offset):
+            count = page_size
+            if max_results is not None:
+                count = min(count, start + max_results - offset)
+            return offset, count
+
+        if last is None:
+            end = max(total or 0, start + 1)
+            if max_results is not None:
+                end = min(end, start + max_results)
+            return [page(offset) for offset in range(start, end, page_size)]
+        offset, count, returned = last
+        if returned < count:
+            return []
+        following = page(offset + count)
+        return [following] if following[1] > 0 else []
+
+    def fetch_all(self, page_size=None, max_results=None, concurrency=None):
+        """
+        Returns every entity matching an evaluate query, in offset order.
+        The number of matches is asked to calchistogram first, then all the
+        pages are requested concurrently by up to `concurrency` threads
+        (AcademicConf.MAX_WORKERS by default), still within the rate limit.
+        If the last page comes back full, because the count was stale,
+        the remaining entities are paged serially (see plan_pages()).
+        """
+        if self.query_type != AcademicQueryType.EVALUATE:
+            raise classes.QueryTypeError('Only evaluate queries can be paginated.')
+        page_size = AcademicUtils.ensure_int(page_size or AcademicConf.MAX_PAGE_RESULTS,
+                                             'page_size must be numeric')
+        start = self.query.offset
+        pages = AcademicQuerier.plan_pages(start, page_size, self.count_entities(), max_results)
+        results = []
+        with ThreadPoolExecutor(max_workers=concurrency or AcademicConf.MAX_WORKERS) as executor:
+            while pages:
+                found = list(executor.map(lambda page: self.page(*page).post(), pages))
+                for entities in found:
+                    results.extend(entities)
+                pages = AcademicQuerier.plan_pages(start, page_size, max_results=max_results,
+                                                   last=pages[-1] + (len(found[-1]),))
+        return results
+
+class AcademicExpressionBatcher(object):
+    """
+    Packs many evaluate sub-expressions into OR(...) expressions that stay
+    within AcademicConf.MAX_EXPR_TERMS terms and AcademicConf.MAX_EXPR_LENGTH
+    characters, runs the batches concurrently, and splits the entities back
+    out to the key of each sub-expression. Looking up N Ids or RIds costs
+    about N / MAX_EXPR_TERMS requests instead of N.
+    """
+    # Attributes holding integers, whose lookup values are coerced to int
+    INT_ATTRIBUTES = ('Id', 'RId', 'Y', 'CC', 'ECC')
+
+    def __init__(self, attributes='Id', session=None, cache=None, lazy=None, concurrency=None,
+                 max_terms=None, max_length=None):
+        self.attributes = attributes
+        self.session = session
+        self.cache = cache
+        self.lazy = lazy
+        self.concurrency = concurrency or AcademicConf.MAX_WORKERS
+        self.max_terms = max_terms or AcademicConf.MAX_EXPR_TERMS
+        self.max_length = max_length or AcademicConf.MAX_EXPR_LENGTH
+
+    @staticmethod
+    def pack(terms, max_terms=None, max_length=None):
+        """
+        Greedily groups the terms, in order, into lists whose OR(...)
+        expression respects the limits. A term longer than max_length
+        on its own is sent alone.
+        """
+        max_terms = max_terms or AcademicConf.MAX_EXPR_TERMS
+        max_length = max_length or AcademicConf.MAX_EXPR_LENGTH
+        batches = []
+        batch, length = [], len('OR()')
+        for term in terms:
+            if batch and (len(batch) >= max_terms or length + 1 + len(term) > max_length):
+                batches.append(batch)
+                batch, length = [], len('OR()')
+            batch.append(term)
+            length += len(term) + (1 if len(batch) > 1 else 0)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def join(terms):
+        """
+        Returns the expression matching any of the terms.
+        """
+        return terms[0] if len(terms) == 1 else 'OR({})'.format(','.join(terms))
+
+    def expressions(self, terms):
+        """
+        Returns the packed OR(...) expressions covering the terms.
+        """
+        return [AcademicExpressionBatcher.join(batch)
+                for batch in AcademicExpressionBatcher.pack(terms, self.max_terms, self.max_length)]
+
+    def _attributes(self, required):
+        names = [name for name in (self.attributes or '').split(',') if name]
+        if '*' in names:
+            return self.attributes
+        return ','.join(names + [name for name in required if name not in names])
+
+    def _run(self, exprs, attributes):
+        """
+        Yields the entities of each expression, the batches being queried concurrently.
+        """
+        def request(expr):
+            querier = AcademicQuerier(AcademicQueryType.EVALUATE, {
+                'expr': expr,
+                'attributes': attributes
+            }, session=self.session, cache=self.cache, lazy=self.lazy)
+            return list(querier.iter_entities(prefetch=False))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for entities in executor.map(request, exprs):
+                yield entities
+
+    def iter_entities(self, terms):
+        """
+        Yields every entity matching any of the sub-expressions, once.
+        """
+        seen = set()
+        for entities in self._run(self.expressions(list(terms)), self._attributes(['Id'])):
+            for entity in entities:
+                if entity['Id'] not in seen:
+                    seen.add(entity['Id'])
+                    yield entity
+
+    def evaluate(self, expressions, matcher, required=None):
+        """
+        Receives a dict of key -> sub-expression and returns a dict of
+        key -> list of the entities matching it. Since a batch answers for
+        all its sub-expressions at once, matcher(entity, keys) must return
+        the keys, among those of the batch, that the entity belongs to;
+        `required` lists the attributes matcher relies on.
+        """
+        keys = list(expressions)
+        batches = AcademicExpressionBatcher.pack([expressions[key] for key in keys],
+                                                 self.max_terms, self.max_length)
+        groups, start = [], 0
+        for batch in batches:
+            groups.append(keys[start:start + len(batch)])
+            start += len(batch)
+        results = dict((key, []) for key in keys)
+        found_ids = dict((key, set()) for key in keys)
+        exprs = [AcademicExpressionBatcher.join(batch) for batch in batches]
+        for group, entities in zip(groups, self._run(exprs, self._attributes(required or ['Id']))):
+            group = set(group)
+            for entity in entities:
+                for key in matcher(entity, group):
+                    if entity['Id'] not in found_ids[key]:
+                        found_ids[key].add(entity['Id'])
+                        results[key].append(entity)
+        return results
+
+    def lookup(self, attribute, values):
+        """
+        Returns a dict of value -> list of the entities whose attribute is,
+        or for a list attribute like RId contains, the value. For instance
+        lookup('RId', ids) returns the papers citing each id. The values of
+        INT_ATTRIBUTES are matched as integers, even when given as strings,
+        but the dict is keyed by the values as given.
+        """
+        values = list(dict.fromkeys(values))
+        keys = values
+        if attribute in self.INT_ATTRIBUTES:
+            msg = 'values of {} must be numeric'.format(attribute)
+            keys = [AcademicUtils.ensure_int(value, msg) for value in values]
+        expressions = dict((key, '{}={}'.format(attribute, key)) for key in keys)
+
+        def matcher(entity, group):
+            found = entity[attribute]
+            if isinstance(found, list):
+                return group.intersection(found)
+            return [found] if found in group else []
+
+        results = self.evaluate(expressions, matcher, ['Id', attribute])
+        return dict((value, results[key]) for value, key in zip(values, keys))
+
+class AcademicTraversal(object):
+    """
+    Client-side multi-hop traversal of the citation graph, for when the
+    graph search endpoint is unavailable or a query cannot be expressed as
+    a path pattern. Each hop follows either the 'references' or the
+    'citations' of the papers reached by the previous one, and is expanded
+    with batched evaluates: OR(Id=...) for references and OR(RId=...) for
+    citations, run concurrently. Papers are deduplicated per level and
+    against the previous levels, so a hop costs a few round-trips, not one per paper.
+    """
+    DIRECTIONS = ('references', 'citations')
+
+    def __init__(self, expr, hops, attributes=None, session=None, cache=None, lazy=None,
+                 concurrency=None, batcher=None):
+        """
+        Constructor that receives the evaluate expression of the starting
+        papers and the direction of each hop, e.g. ['citations'] for the
+        papers citing the starting ones. Id and RId are always requested
+        on top of the given attributes, as the expansion relies on them.
+        """
+        for direction in hops:
+            if direction not in self.DIRECTIONS:
+                raise classes.FormatError('hops must be one of {}'.format(self.DIRECTIONS))
+        self.expr = expr
+        self.hops = list(hops)
+        names = [name for name in (attributes or '').split(',') if name]
+        self.attributes = ','.join(['Id', 'RId'] + [name for name in names
+                                                    if name not in ('Id', 'RId')])
+        self.session = session
+        self.cache = cache
+        self.lazy = lazy
+        self.batcher = batcher or AcademicExpressionBatcher(
+            self.attributes, session=session, cache=cache, lazy=lazy, concurrency=concurrency)
+        self.parents = {}
+
+    def expand(self, papers, direction, seen):
+        """
+        Returns the papers one hop away from papers in the given direction
+        and not in seen, recording the papers they were reached from in parents.
+        """
+        level = {}
+        if direction == 'references':
+            wanted = {}
+            for paper in papers:
+                for reference in paper['RId'] or []:
+                    if reference not in seen:
+                        wanted.setdefault(reference, []).append(paper['Id'])
+            for reference, found in self.batcher.lookup('Id', wanted).items():
+                for paper in found:
+                    level[paper['Id']] = paper
+                    self.parents[paper['Id']] = wanted[reference]
+        else:
+            frontier = sorted(set(paper['Id'] for paper in papers))
+            for parent, found in self.batcher.lookup('RId', frontier).items():
+                for paper in found:
+                    if paper['Id'] in seen:
+                        continue
+                    level.setdefault(paper['Id'], paper)
+                    self.parents.setdefault(paper['Id'], []).append(parent)
+        return list(level.values())
+
+    def levels(self):
+        """
+        Yields the list of papers of each level, starting with the papers
+        matching the expression and followed by one list per hop.
+        Traversal stops early when a level comes back empty.
+        """
+        querier = AcademicQuerier(AcademicQueryType.EVALUATE, {
+            'expr': self.expr,
+            'attributes': self.attributes
+        }, session=self.session, cache=self.cache, lazy=self.lazy)
+        papers = list(querier.iter_entities())
+        seen = set(paper['Id'] for paper in papers)
+        yield papers
+        for direction in self.hops:
+            if not papers:
+                return
+            papers = self.expand(papers, direction, seen)
+            seen.update(paper['Id'] for paper in papers)
+            yield papers
+
+    def run(self):
+        """
+        Returns the papers reached by the last hop.
+        """
+        papers = []
+        for papers in self.levels():
+            pass
+        return papers
+
+class AsyncAcademicSession(object):
+    """
+    The asyncio counterpart of AcademicSession.
+    It wraps an aiohttp.ClientSession whose connector caps the number of
+    open connections, so a single event loop can keep hundreds of queries
+    in flight over a few keep-alive connections.
+    The underlying client session is opened lazily inside the running loop.
+    """
+
+    def __init__(self, subscription_key=None, limit=None, limiter=None, retry_policy=None):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for asynchronous queries')
+        if subscription_key is None:
+            subscription_key = os.getenv('MAKA_SUBSCRIPTION_KEY', None)
+        if subscription_key is None:
+            raise KeyError('MAKA_SUBSCRIPTION_KEY')
+        self.subscription_key = subscription_key
+        self.headers = {
             'user-agent': AcademicConf.USER_AGENT,
-            'Ocp-Apim-Subscription-Key': os.environ['MAKA_SUBSCRIPTION_KEY']
+            'Ocp-Apim-Subscription-Key': subscription_key
+        }
+        self.limit = limit or AcademicConf.ASYNC_POOL_LIMIT
+        self.limiter = limiter or AcademicUtils.rate_limiter(subscription_key)
+        self.retry_policy = retry_policy or AcademicUtils.retry_policy()
+        self.session = None
+        self.requests_sent = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def post(self, url, data=None, headers=None):
+        """
+        Sends a POST request and returns a (status code, text, headers) tuple.
+        """
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self.session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+        self.requests_sent += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            async with self.session.post(url, data=data, headers=headers) as response:
+                return response.status, await response.text(), response.headers
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        """
+        Returns the usage counters of the session.
+        """
+        return {
+            'requests': self.requests_sent,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'limit': self.limit
         }
+
+    async def close(self):
+        """
+        Closes the client session and its connections.
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+class AsyncAcademicQuerier(object):
+    """
+    Asynchronous version of AcademicQuerier.
+    It builds the same queries and parses the responses with the same parsers,
+    but its post() is a coroutine meant to run inside an asyncio event loop.
+    """
+
+    def __init__(self, query_type, arguments=None, session=None, cache=None, lazy=None):
+        """
+        Constructor that receives the type of query and a set of arguments
+        to pass to the query. If no AsyncAcademicSession is given, post()
+        opens a short-lived one.
+        Responses are looked up in and stored to the given AcademicCache,
+        or AcademicConf.CACHE when none is given. With lazy parsing (which
+        defaults to AcademicConf.LAZY_PARSING), the authors, fields of study
+        and metadata of papers are only decoded when first accessed.
+        """
+        self.query_type = query_type
+        self.session = session
+        self.cache = cache
+        self.lazy = AcademicConf.LAZY_PARSING if lazy is None else lazy
+        self.query = AcademicQuerier.build_query(query_type, arguments)
+
+    async def post(self, session=None):
+        """
+        Sends the query and returns the parsed results.
+        """
+        results = AcademicQuerier.parse_response(self.query_type, 200,
+                                                 await self.fetch(session), self.lazy)
+        return AcademicQuerier.paginate(self.query_type, self.query, results)
+
+    async def fetch(self, session=None):
+        """
+        Sends the query and returns the raw text of the successful response.
+        """
+        cache = self.cache or AcademicConf.CACHE
         url = self.query.get_url()
         data = self.query.get_body()
-        AcademicUtils.log('debug', 'Sending {}/{}'.format(url, data))
-        the_request = requests.post(url, data=data, headers=headers)
-        AcademicUtils.log('debug', 'Received {}'.format(the_request.text))
-        if  the_request.status_code < 300:
-            if self.query_type == AcademicQueryType.INTERPRET:
-                jobject = the_request.json()
-                return [classes.AcademicInterpretationParser.parse(interpretation)
-                        for interpretation in jobject['interpretations']]
-            elif self.query_type == AcademicQueryType.EVALUATE:
-                jobject = the_request.json()
-                return [classes.AcademicPaperParser.parse(entity) for entity in jobject['entities']]
-            elif self.query_type == AcademicQueryType.SIMILARITY:
-                return float(the_request.text)
-            elif self.query_type == AcademicQueryType.HISTOGRAM:
-                jobject = the_request.json()
-                return [classes.AcademicHistogramParser.parse(entity)
-                        for entity in jobject['histograms']]
-        else:
-            raise classes.Error('An error ocurred while processing the request. Code: {}'
-                                .format(the_request.status_code))
+        if cache is not None:
+            text = cache.get(url, data)
+            if text is not None:
+                return text
+        session = session or self.session
+        owned = session is None
+        if owned:
+            session = AsyncAcademicSession()
+        try:
+            history = []
+            while True:
+                await session.limiter.acquire_async()
+                AcademicUtils.log('debug', 'Sending {}/{}'.format(url, data))
+                try:
+                    status_code, text, headers = await session.post(
+                        url, data=data, headers=self.query.get_headers())
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    delay = session.retry_policy.next_delay(history, None, reason=str(error))
+                else:
+                    AcademicUtils.log('debug', 'Received {} ({} chars)'.format(url, len(text)))
+                    if status_code < 300:
+                        break
+                    retry_after = AcademicRetryPolicy.parse_retry_after(headers.get('Retry-After'))
+                    delay = session.retry_policy.next_delay(history, status_code, retry_after)
+                AcademicUtils.log('warn', 'Retrying {} in {:.2f}s'.format(url, delay))
+                await asyncio.sleep(delay)
+        finally:
+            if owned:
+                await session.close()
+        if cache is not None:
+            cache.put(url, data, text)
+        return text
+
+    def page(self, offset, count):
+        """
+        Returns a copy of this querier asking for `count` results from `offset`.
+        """
+        querier = copy.copy(self)
+        querier.query = copy.copy(self.query)
+        querier.query.set_offset(offset)
+        querier.query.set_count(count)
+        return querier
+
+    async def count_entities(self, attribute=None, session=None):
+        """
+        Returns how many entities match the expression of an evaluate query,
+        as reported by the total_count of a calchistogram on the attribute.
+        """
+        counter = AsyncAcademicQuerier(AcademicQueryType.HISTOGRAM, {
+            'expr': self.query.expr,
+            'attributes': attribute or AcademicConf.COUNT_ATTRIBUTE,
+            'count': 1,
+            'model': self.query.model
+        }, session=self.session, cache=self.cache)
+        histograms = await counter.post(session)
+        return histograms[0]['count'] or 0 if histograms else 0
+
+    async def fetch_all(self, page_size=None, max_results=None, concurrency=None, session=None):
+        """
+        Returns every entity matching an evaluate query, in offset order.
+        Same as AcademicQuerier.fetch_all(), but the pages are gathered
+        on the event loop, at most `concurrency` of them in flight.
+        """
+        if self.query_type != AcademicQueryType.EVALUATE:
+            raise classes.QueryTypeError('Only evaluate queries can be paginated.')
+        page_size = AcademicUtils.ensure_int(page_size or AcademicConf.MAX_PAGE_RESULTS,
+                                             'page_size must be numeric')
+        session = session or self.session
+        start = self.query.offset
+        pages = AcademicQuerier.plan_pages(start, page_size,
+                                           await self.count_entities(session=session),
+                                           max_results)
+        results = []
+        while pages:
+            found = await AsyncAcademicQuerier.gather([self.page(*page) for page in pages],
+                                                      concurrency, session)
+            for entities in found:
+                results.extend(entities)
+            pages = AcademicQuerier.plan_pages(start, page_size, max_results=max_results,
+                                               last=pages[-1] + (len(found[-1]),))
+        return results
+
+    @staticmethod
+    async def gather(queries, concurrency=None, session=None, return_exceptions=False):
+        """
+        Runs many queries concurrently and returns their results in order.
+        Each query is either an AsyncAcademicQuerier or a
+        (query_type, arguments) tuple. At most `concurrency` queries are
+        in flight at the same time, all of them sharing one session.
+        """
+        queriers = [query if isinstance(query, AsyncAcademicQuerier)
+                    else AsyncAcademicQuerier(*query) for query in queries]
+        semaphore = asyncio.Semaphore(concurrency or AcademicConf.ASYNC_CONCURRENCY)
+        owned = session is None
+        if owned:
+            session = AsyncAcademicSession()
+
+        async def run(querier):
+            async with semaphore:
+                return await querier.post(querier.session or session)
+
+        try:
+            return await asyncio.gather(*[run(querier) for querier in queriers],
+                                        return_exceptions=return_exceptions)
+        finally:
+            if owned:
+                await session.close()
+
+    @staticmethod
+    def run(queries, concurrency=None, return_exceptions=False):
+        """
+        Synchronous entry point to gather(): runs the queries in a new event loop.
+        """
+        return asyncio.run(AsyncAcademicQuerier.gather(
+            queries, concurrency=concurrency, return_exceptions=return_exceptions))
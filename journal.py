@@ -0,0 +1,169 @@
+"""
+Write-ahead journal making crawls resumable.
+"""
+import json
+import os
+
+import classes
+
+class AcademicCrawlJournal(object):
+    """
+    Appends the progress of a crawl, one JSON record per line, to a local
+    log, and periodically compacts it into a snapshot. Each record holds the
+    id of the task which progressed (None for seeds), the (parent, id) pairs
+    it found, the tasks it scheduled, its updated payload (e.g. the next
+    evaluate offset) and whether it is done. Replaying the snapshot and the
+    log gives back the pending tasks, the seen ids and the citation index,
+    so an interrupted crawl resumes without re-sending the queries which
+    already succeeded. Records are flushed to the operating system as they
+    are written, and also synced to the disk when fsync is set.
+    The journal is not thread-safe: the crawler serializes its calls.
+    """
+    LOG = 'journal.log'
+    SNAPSHOT = 'snapshot.json'
+
+    def __init__(self, directory, compact_every=10000, fsync=False):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.log_path = os.path.join(directory, self.LOG)
+        self.snapshot_path = os.path.join(directory, self.SNAPSHOT)
+        self.pending = {}
+        self.records = 0
+        self._handle = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def exists(self):
+        """
+        Returns whether there is a journal to resume from.
+        """
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.log_path)
+
+    def reset(self):
+        """
+        Discards the previous journal, if any, to start a new crawl.
+        """
+        self.close()
+        for path in (self.snapshot_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.pending = {}
+        self.records = 0
+
+    def load(self):
+        """
+        Replays the snapshot and the log and returns the state of the crawl,
+        a dict with the pending 'tasks' (as dicts, keyed by id), the 'seen'
+        ids, the 'children' of each parent and the 'next_id' of tasks.
+        A truncated last record, left by a crash, is dropped from the log.
+        """
+        state = {'tasks': {}, 'seen': set(), 'children': {}, 'next_id': 0}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as snapshot:
+                saved = json.load(snapshot)
+            state['tasks'] = dict((task['id'], task) for task in saved['tasks'])
+            state['seen'] = set(saved['seen'])
+            state['children'] = dict((int(parent), set(children))
+                                     for parent, children in saved['children'].items())
+            state['next_id'] = saved['next_id']
+        self.records = 0
+        if os.path.exists(self.log_path):
+            valid = 0
+            with open(self.log_path, 'rb') as log:
+                for line in log:
+                    try:
+                        record = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        break
+                    if not line.endswith(b'\n'):
+                        break
+                    AcademicCrawlJournal.apply(state, record)
+                    self.records += 1
+                    valid += len(line)
+            if valid < os.path.getsize(self.log_path):
+                with open(self.log_path, 'r+b') as log:
+                    log.truncate(valid)
+        self.pending = state['tasks']
+        return state
+
+    @staticmethod
+    def apply(state, record):
+        """
+        Applies one record of the log to a crawl state.
+        """
+        for parent, child in record['pairs']:
+            state['seen'].add(child)
+            if parent is not None:
+                state['children'].setdefault(parent, set()).add(child)
+        for task in record['tasks']:
+            state['tasks'][task['id']] = task
+            state['next_id'] = max(state['next_id'], task['id'] + 1)
+        task = state['tasks'].get(record['id'])
+        if task is not None:
+            if record['done']:
+                del state['tasks'][record['id']]
+            elif record['payload'] is not None:
+                task['payload'] = record['payload']
+
+    def append(self, task_id, pairs=(), tasks=(), payload=None, done=False):
+        """
+        Writes one record. tasks are given as dicts.
+        """
+        record = {
+            'id': task_id,
+            'pairs': [list(pair) for pair in pairs],
+            'tasks': list(tasks),
+            'payload': payload,
+            'done': done
+        }
+        if self._handle is None:
+            self._handle = open(self.log_path, 'a')
+        self._handle.write(json.dumps(record, separators=(',', ':'), cls=classes.AcademicEncoder)
+                           + '\n')
+        self._handle.flush()
+        if self.fsync:
+            os.fsync(self._handle.fileno())
+        for task in tasks:
+            self.pending[task['id']] = task
+        if task_id in self.pending:
+            if done:
+                del self.pending[task_id]
+            elif payload is not None:
+                self.pending[task_id]['payload'] = payload
+        self.records += 1
+
+    def needs_compaction(self):
+        """
+        Returns whether compact_every records were appended since the last snapshot.
+        """
+        return bool(self.compact_every) and self.records >= self.compact_every
+
+    def compact(self, seen, children, next_id):
+        """
+        Writes a snapshot of the given journaled state plus the pending tasks,
+        then empties the log. The snapshot replaces the previous one atomically.
+        """
+        snapshot = {
+            'tasks': list(self.pending.values()),
+            'seen': sorted(seen),
+            'children': dict((str(parent), sorted(ids)) for parent, ids in children.items()),
+            'next_id': next_id
+        }
+        temporary = self.snapshot_path + '.tmp'
+        with open(temporary, 'w') as output:
+            json.dump(snapshot, output, separators=(',', ':'))
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary, self.snapshot_path)
+        self.close()
+        open(self.log_path, 'w').close()
+        self.records = 0
+
+    def close(self):
+        """
+        Closes the log.
+        """
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
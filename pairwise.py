@@ -0,0 +1,435 @@
+"""
+All-pairs similarity of texts on top of the Similarity endpoint.
+"""
+import os
+import threading
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import classes
+import inquirer
+
+# Records of the scores streamed to disk: row, column and score of a pair
+SCORE_DTYPE = np.dtype([('row', '<i4'), ('col', '<i4'), ('score', '<f4')])
+
+class AcademicSparseMatrix(object):
+    """
+    A minimal coordinate-format sparse matrix of similarity scores.
+    Pairs which are not stored score 0.
+    """
+
+    def __init__(self, shape, rows, cols, data):
+        self.shape = tuple(shape)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.cols = np.asarray(cols, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.float32)
+
+    @staticmethod
+    def from_records(shape, records):
+        """
+        Builds the matrix from an array of SCORE_DTYPE records.
+        """
+        return AcademicSparseMatrix(shape, records['row'], records['col'], records['score'])
+
+    @property
+    def nnz(self):
+        """
+        The number of stored scores.
+        """
+        return len(self.data)
+
+    def __getitem__(self, position):
+        row, col = position
+        found = np.flatnonzero((self.rows == row) & (self.cols == col))
+        return float(self.data[found[-1]]) if len(found) else 0.0
+
+    def toarray(self):
+        """
+        Returns the matrix as a dense array.
+        """
+        dense = np.zeros(self.shape, dtype=np.float32)
+        dense[self.rows, self.cols] = self.data
+        return dense
+
+    def save(self, path):
+        """
+        Saves the matrix into an .npz file.
+        """
+        np.savez(path, shape=np.asarray(self.shape), rows=self.rows, cols=self.cols,
+                 data=self.data)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a matrix saved with save().
+        """
+        with np.load(path) as archive:
+            return AcademicSparseMatrix(archive['shape'], archive['rows'], archive['cols'],
+                                        archive['data'])
+
+class AcademicMinHashFilter(object):
+    """
+    A local prefilter of the pairs of texts worth sending to the Similarity
+    endpoint. Texts are shingled into character k-grams and summarized by
+    MinHash signatures, computed for all the texts at once with NumPy.
+    Locality-sensitive hashing over bands of the signatures buckets the
+    texts, so only pairs sharing a bucket become candidates, and those
+    whose estimated Jaccard similarity is at least threshold pass.
+
+    Counters compare the filter with the remote scores: a pair is relevant
+    when its remote score is at least `relevant`. Precision is measured on
+    the pairs which passed. Recall is estimated by also sending `audit`
+    randomly sampled rejected pairs per matrix. Texts without any shingle
+    (empty ones) never pass.
+    """
+    _MASK = np.uint64(0xffffffff)
+    # Number of candidate pairs whose signatures are compared at once
+    ESTIMATE_CHUNK = 64 * 1024
+
+    def __init__(self, threshold=0.3, num_perm=128, bands=32, shingle=3, relevant=0.5,
+                 audit=0, max_bucket=1000, seed=1):
+        if num_perm % bands:
+            raise classes.FormatError('num_perm must be a multiple of bands')
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle = shingle
+        self.relevant = relevant
+        self.audit = audit
+        self.max_bucket = max_bucket
+        self.random = np.random.RandomState(seed)
+        # Multiply-shift hash functions: (a * x + b) mod 2^64 >> 32, with odd a
+        self._a = self.random.randint(1, 2 ** 62, size=num_perm, dtype=np.uint64) * 2 + 1
+        self._b = self.random.randint(0, 2 ** 62, size=num_perm, dtype=np.uint64)
+        self._band_mix = self.random.randint(1, 2 ** 62, size=num_perm // bands,
+                                             dtype=np.uint64) * 2 + 1
+        self.counters = dict.fromkeys(('pairs', 'candidates', 'passed', 'passed_relevant',
+                                       'rejected', 'audited', 'audited_relevant'), 0)
+
+    def shingles(self, text):
+        """
+        Returns the 32-bit hashes of the distinct character k-grams of a text.
+        """
+        text = ' '.join(text.lower().split())
+        size = self.shingle
+        grams = set(text[start:start + size] for start in range(max(len(text) - size + 1, 0)))
+        if not grams and text:
+            grams.add(text)
+        return np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams),
+                           dtype=np.uint64, count=len(grams))
+
+    def signatures(self, texts):
+        """
+        Returns the MinHash signatures of the texts, one row per text, and a
+        mask of the texts having shingles. Rows of texts without shingles are all ones.
+        """
+        hashed = [self.shingles(text) for text in texts]
+        lengths = np.array([len(hashes) for hashes in hashed], dtype=np.int64)
+        signatures = np.full((len(texts), self.num_perm), self._MASK, dtype=np.uint64)
+        present = lengths > 0
+        if not present.any():
+            return signatures, present
+        values = np.concatenate(hashed)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[present]
+        for perm in range(self.num_perm):
+            permuted = (self._a[perm] * values + self._b[perm]) >> np.uint64(32)
+            signatures[present, perm] = np.minimum.reduceat(permuted, starts)
+        return signatures, present
+
+    def _bucket_pairs(self, keys, rows, sources):
+        """
+        Returns the pairs of rows sharing a key, as (first, second) arrays.
+        With sources, only pairs of rows from different sources are kept,
+        the row of source 0 first.
+        """
+        order = np.argsort(keys, kind='stable')
+        keys, rows, sources = keys[order], rows[order], sources[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        starts = np.concatenate([[0], bounds])
+        sizes = np.diff(np.concatenate([starts, [len(keys)]]))
+        # Buckets of two, by far the most common, are paired at once
+        firsts, seconds = [starts[sizes == 2]], [starts[sizes == 2] + 1]
+        shared = (sizes > 2) & (sizes <= self.max_bucket)
+        for start, size in zip(starts[shared].tolist(), sizes[shared].tolist()):
+            left, right = np.triu_indices(size, 1)
+            firsts.append(left + start)
+            seconds.append(right + start)
+        left, right = np.concatenate(firsts), np.concatenate(seconds)
+        keep = sources[left] != sources[right]
+        left, right = left[keep], right[keep]
+        swap = sources[left] > sources[right]
+        left, right = np.where(swap, right, left), np.where(swap, left, right)
+        return rows[left], rows[right]
+
+    def candidates(self, texts_a, texts_b=None):
+        """
+        Returns the (row, column) arrays of the pairs which pass the filter
+        and of the rejected pairs sampled for the audit. Without texts_b,
+        pairs of texts_a with each other are given in the upper triangle.
+        """
+        texts_a = list(texts_a)
+        symmetric = texts_b is None
+        texts_b = [] if symmetric else list(texts_b)
+        signatures, present = self.signatures(texts_a + texts_b)
+        count_a = len(texts_a)
+        columns = count_a if symmetric else len(texts_b)
+        rows = np.flatnonzero(present)
+        # Symmetric pairs come from one source: every row gets its own
+        sources = rows if symmetric else (rows >= count_a).astype(np.int64)
+        per_band = self.num_perm // self.bands
+        codes = []
+        for band in range(self.bands):
+            block = signatures[rows, band * per_band:(band + 1) * per_band]
+            keys = np.bitwise_xor.reduce(block * self._band_mix, axis=1)
+            first, second = self._bucket_pairs(keys, rows, sources)
+            if symmetric:
+                first, second = np.minimum(first, second), np.maximum(first, second)
+            else:
+                second = second - count_a
+            codes.append(first * columns + second)
+        codes = np.unique(np.concatenate(codes)) if codes else np.zeros(0, dtype=np.int64)
+        first, second = codes // max(columns, 1), codes % max(columns, 1)
+        offset = 0 if symmetric else count_a
+        passed = np.zeros(len(codes), dtype=bool)
+        for start in range(0, len(codes), self.ESTIMATE_CHUNK):
+            chunk = slice(start, start + self.ESTIMATE_CHUNK)
+            matches = signatures[first[chunk]] == signatures[second[chunk] + offset]
+            passed[chunk] = matches.mean(axis=1) >= self.threshold
+        total = count_a * (count_a - 1) // 2 if symmetric else count_a * columns
+        self.counters['pairs'] += total
+        self.counters['candidates'] += len(codes)
+        self.counters['rejected'] += total - int(passed.sum())
+        audit = self._sample_rejected(codes[passed], count_a, columns, symmetric, total)
+        return (first[passed], second[passed]), (audit // max(columns, 1), audit % max(columns, 1))
+
+    def _sample_rejected(self, passed, rows, columns, symmetric, total):
+        """
+        Returns the codes of up to `audit` distinct random pairs which did not pass.
+        """
+        wanted = min(self.audit, total - len(passed))
+        if wanted <= 0:
+            return np.zeros(0, dtype=np.int64)
+        sampled = np.zeros(0, dtype=np.int64)
+        while len(sampled) < wanted:
+            first = self.random.randint(0, rows, size=2 * wanted)
+            second = self.random.randint(0, columns, size=2 * wanted)
+            if symmetric:
+                keep = first != second
+                first, second = first[keep], second[keep]
+                first, second = np.minimum(first, second), np.maximum(first, second)
+            codes = first.astype(np.int64) * columns + second
+            codes = np.setdiff1d(codes, passed)
+            sampled = np.union1d(sampled, codes)
+        return self.random.permutation(sampled)[:wanted]
+
+    def observe(self, passed_scores, audited_scores):
+        """
+        Counts the remote scores of the pairs which passed and of the audited ones.
+        """
+        passed_scores = np.asarray(passed_scores, dtype=np.float64)
+        audited_scores = np.asarray(audited_scores, dtype=np.float64)
+        self.counters['passed'] += len(passed_scores)
+        self.counters['passed_relevant'] += int((passed_scores >= self.relevant).sum())
+        self.counters['audited'] += len(audited_scores)
+        self.counters['audited_relevant'] += int((audited_scores >= self.relevant).sum())
+
+    def stats(self):
+        """
+        Returns the counters, with the share of the pairs which were not sent,
+        the precision of the filter and its estimated recall (None until measurable).
+        """
+        counters = dict(self.counters)
+        passed, relevant = counters['passed'], counters['passed_relevant']
+        counters['saved'] = 1 - passed / counters['pairs'] if counters['pairs'] else None
+        counters['precision'] = relevant / passed if passed else None
+        counters['recall'] = None
+        if counters['audited']:
+            missed = counters['audited_relevant'] * counters['rejected'] / counters['audited']
+            counters['recall'] = relevant / (relevant + missed) if relevant + missed else None
+        return counters
+
+class AcademicSimilarity(object):
+    """
+    Scores pairs of texts with the Similarity endpoint. The score of a pair
+    does not depend on the order of its texts, so pairs are always sent in
+    the same order and memoized under that order-independent key, in memory
+    and, through the queriers, in the AcademicCache if any. Pairs are scored
+    concurrently by up to `concurrency` threads (AcademicConf.MAX_WORKERS
+    by default), within the rate limit of the session.
+    """
+    # Above this number of cells, matrices are returned sparse
+    SPARSE_THRESHOLD = 4 * 1024 * 1024
+    # Number of pairs scored between two writes of the streamed output
+    CHUNK_SIZE = 1024
+
+    def __init__(self, session=None, cache=None, concurrency=None):
+        self.session = session
+        self.cache = cache
+        self.concurrency = concurrency or inquirer.AcademicConf.MAX_WORKERS
+        self.memo = {}
+        self.requests_sent = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(first, second):
+        """
+        Returns the order-independent key of a pair of texts.
+        """
+        return (first, second) if first <= second else (second, first)
+
+    def _request(self, key):
+        querier = inquirer.AcademicQuerier(inquirer.AcademicQueryType.SIMILARITY, {
+            's1': key[0],
+            's2': key[1]
+        }, session=self.session, cache=self.cache)
+        score = querier.post()
+        with self._lock:
+            self.memo[key] = score
+            self.requests_sent += 1
+        return score
+
+    def scores(self, pairs):
+        """
+        Returns the score of each (text, text) pair. Identical texts score 1,
+        and every distinct pair not memoized yet is sent once.
+        """
+        keys = [AcademicSimilarity.key(first, second) for first, second in pairs]
+        with self._lock:
+            missing = list(dict.fromkeys(key for key in keys
+                                         if key[0] != key[1] and key not in self.memo))
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(self._request, missing))
+        with self._lock:
+            return [1.0 if key[0] == key[1] else self.memo[key] for key in keys]
+
+    def score(self, first, second):
+        """
+        Returns the similarity of two texts.
+        """
+        return self.scores([(first, second)])[0]
+
+    @staticmethod
+    def iter_pairs(rows, cols, symmetric):
+        """
+        Yields the (row, column) positions to score: every cell, or only the
+        upper triangle without the diagonal for a symmetric matrix.
+        """
+        for row in range(rows):
+            for col in range(row + 1 if symmetric else 0, cols):
+                yield row, col
+
+    @staticmethod
+    def load_records(output):
+        """
+        Returns the records streamed to an output file. A torn last record,
+        left by an interrupted run, is cut from the file.
+        """
+        if output is None or not os.path.exists(output):
+            return np.zeros(0, dtype=SCORE_DTYPE)
+        size = os.path.getsize(output) // SCORE_DTYPE.itemsize * SCORE_DTYPE.itemsize
+        with open(output, 'r+b') as handle:
+            handle.truncate(size)
+            return np.frombuffer(handle.read(size), dtype=SCORE_DTYPE)
+
+    def matrix(self, texts_a, texts_b=None, sparse=None, min_score=0.0, output=None,
+               candidates=None, prefilter=None):
+        """
+        Returns the similarity of every text of texts_a with every text of
+        texts_b, or with each other when texts_b is None. In the latter case,
+        the matrix is symmetric: only the upper triangle is scored and the
+        diagonal is 1.
+
+        The matrix is a dense float32 array, unless sparse is set or, by
+        default, it has more than SPARSE_THRESHOLD cells. Sparse matrices
+        only keep the scores above min_score.
+
+        With output, the scores are appended to that file as SCORE_DTYPE
+        records every CHUNK_SIZE pairs, and the pairs already recorded there
+        are not scored again, so large runs can be resumed. candidates, an
+        iterable of (row, column) positions, restricts the pairs scored;
+        the others are left at 0. For a symmetric matrix, candidates must lie
+        in the upper triangle. A prefilter, like AcademicMinHashFilter,
+        picks the candidates locally and is told the remote scores of the
+        pairs it passed and of those it sampled for its audit.
+        """
+        texts_a = list(texts_a)
+        symmetric = texts_b is None
+        texts_b = texts_a if symmetric else list(texts_b)
+        shape = (len(texts_a), len(texts_b))
+        if sparse is None:
+            sparse = shape[0] * shape[1] > self.SPARSE_THRESHOLD
+        audited = None
+        if prefilter is not None:
+            passed, audited = prefilter.candidates(texts_a, None if symmetric else texts_b)
+            candidates = list(zip(np.concatenate([passed[0], audited[0]]).tolist(),
+                                  np.concatenate([passed[1], audited[1]]).tolist()))
+        elif candidates is None:
+            candidates = AcademicSimilarity.iter_pairs(shape[0], shape[1], symmetric)
+
+        records = AcademicSimilarity.load_records(output)
+        done = set(zip(records['row'].tolist(), records['col'].tolist()))
+        chunks = [records]
+        handle = None if output is None else open(output, 'ab')
+        try:
+            positions = []
+            for position in candidates:
+                if position not in done:
+                    positions.append(position)
+                if len(positions) >= self.CHUNK_SIZE:
+                    chunks.append(self._score_chunk(positions, texts_a, texts_b, handle))
+                    positions = []
+            if positions:
+                chunks.append(self._score_chunk(positions, texts_a, texts_b, handle))
+        finally:
+            if handle is not None:
+                handle.close()
+        records = np.concatenate(chunks)
+
+        if prefilter is not None:
+            scored = dict(zip(zip(records['row'].tolist(), records['col'].tolist()),
+                              records['score'].tolist()))
+            audited = set(zip(audited[0].tolist(), audited[1].tolist()))
+            prefilter.observe([scored[position] for position in candidates
+                               if position not in audited],
+                              [scored[position] for position in audited])
+
+        if symmetric:
+            mirrored = records.copy()
+            mirrored['row'], mirrored['col'] = records['col'], records['row']
+            diagonal = np.zeros(shape[0], dtype=SCORE_DTYPE)
+            diagonal['row'] = diagonal['col'] = np.arange(shape[0])
+            diagonal['score'] = 1.0
+            records = np.concatenate([records, mirrored, diagonal])
+        if sparse:
+            return AcademicSparseMatrix.from_records(shape, records[records['score'] > min_score])
+        dense = np.zeros(shape, dtype=np.float32)
+        dense[records['row'], records['col']] = records['score']
+        return dense
+
+    def _score_chunk(self, positions, texts_a, texts_b, handle):
+        """
+        Scores the pairs at positions and returns them as records,
+        also appended to handle when given.
+        """
+        scores = self.scores([(texts_a[row], texts_b[col]) for row, col in positions])
+        records = np.zeros(len(positions), dtype=SCORE_DTYPE)
+        records['row'], records['col'] = zip(*positions)
+        records['score'] = scores
+        if handle is not None:
+            handle.write(records.tobytes())
+            handle.flush()
+        return records
+
+def similarity_matrix(texts_a, texts_b=None, **kwargs):
+    """
+    Returns the similarity matrix of texts_a with texts_b, or with each other.
+    Keyword arguments are split between AcademicSimilarity (session, cache,
+    concurrency) and AcademicSimilarity.matrix().
+    """
+    options = dict((name, kwargs.pop(name)) for name in ('session', 'cache', 'concurrency')
+                   if name in kwargs)
+    return AcademicSimilarity(**options).matrix(texts_a, texts_b, **kwargs)
@@ -0,0 +1,125 @@
+"""
+Parsing of API responses in a pool of worker processes.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import inquirer
+
+def _parse(query_type, text, lazy):
+    """
+    Parses the raw text of a successful response. Runs in the worker processes.
+    """
+    return inquirer.AcademicQuerier.parse_response(query_type, 200, text, lazy)
+
+def _chain(source, target, transform=None):
+    """
+    Copies the outcome of the source future into the target one.
+    """
+    error = source.exception()
+    if error is not None:
+        target.set_exception(error)
+        return
+    result = source.result()
+    try:
+        target.set_result(result if transform is None else transform(result))
+    except Exception as error: # pylint: disable=broad-except
+        target.set_exception(error)
+
+class AcademicParsePipeline(object):
+    """
+    Sends queries from a pool of threads and parses their responses in a
+    pool of processes. Decoding JSON and building the Academic objects of
+    large pages is CPU-bound and holds the GIL, so parsing in the querying
+    threads serializes them on one core; here the threads only wait for the
+    network while the raw texts are parsed on every core. Parsed entities
+    travel back pickled, which costs the main process about as much as
+    json.loads of the raw text, well under a full parse.
+    Queries go through fetch(), so the cache, the rate limit and the retries
+    of the queriers apply.
+    """
+
+    def __init__(self, processes=None, threads=None, lazy=False):
+        """
+        processes defaults to the number of cores, and threads to AcademicConf.MAX_WORKERS.
+        Lazy parsing is off by default, as deferred values would be decoded
+        by the main process.
+        """
+        self.lazy = lazy
+        self.threads = threads or inquirer.AcademicConf.MAX_WORKERS
+        self._fetchers = ThreadPoolExecutor(max_workers=self.threads)
+        self._parsers = ProcessPoolExecutor(max_workers=processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, querier):
+        """
+        Schedules a querier and returns a Future of its parsed results.
+        """
+        outer = Future()
+
+        def parse(fetched):
+            error = fetched.exception()
+            if error is not None:
+                outer.set_exception(error)
+                return
+            try:
+                parsed = self._parsers.submit(_parse, querier.query_type, fetched.result(),
+                                              self.lazy)
+            except Exception as error: # pylint: disable=broad-except
+                outer.set_exception(error)
+                return
+            parsed.add_done_callback(lambda future: _chain(
+                future, outer,
+                lambda results: inquirer.AcademicQuerier.paginate(querier.query_type,
+                                                                  querier.query, results)))
+
+        self._fetchers.submit(querier.fetch).add_done_callback(parse)
+        return outer
+
+    def post(self, querier):
+        """
+        Sends a query through the pipeline and returns its parsed results.
+        """
+        return self.submit(querier).result()
+
+    def map(self, queriers):
+        """
+        Yields the parsed results of each querier, in order, keeping at most
+        twice as many queries in flight as there are threads.
+        """
+        pending = []
+        for querier in queriers:
+            pending.append(self.submit(querier))
+            if len(pending) >= 2 * self.threads:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+    def fetch_all(self, querier, page_size=None, max_results=None):
+        """
+        Returns every entity matching an evaluate query, in offset order,
+        like AcademicQuerier.fetch_all() but parsing the pages in the processes.
+        """
+        page_size = page_size or inquirer.AcademicConf.MAX_PAGE_RESULTS
+        start = querier.query.offset
+        pages = inquirer.AcademicQuerier.plan_pages(start, page_size, querier.count_entities(),
+                                                    max_results)
+        results = []
+        while pages:
+            found = list(self.map(querier.page(*page) for page in pages))
+            for entities in found:
+                results.extend(entities)
+            pages = inquirer.AcademicQuerier.plan_pages(start, page_size, max_results=max_results,
+                                                        last=pages[-1] + (len(found[-1]),))
+        return results
+
+    def close(self):
+        """
+        Waits for the queries in flight and stops the pools.
+        """
+        self._fetchers.shutdown(wait=True)
+        self._parsers.shutdown(wait=True)
@@ -0,0 +1,200 @@
+"""
+Throttling helpers shared by the queriers: a token-bucket rate limiter
+per subscription key and a retry policy with jittered exponential backoff.
+"""
+import asyncio
+import email.utils
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # pylint: disable-msg=C0103
+
+import classes
+
+class AcademicRateLimiter(object):
+    """
+    A token bucket refilled at `calls_per_second` and holding at most `burst`
+    tokens, plus a budget of `calls_per_month` calls per calendar month (UTC).
+    A zero rate or budget disables the corresponding limit.
+    The limiter is thread-safe and can be awaited from asyncio tasks. When a
+    `state_path` is given, the bucket lives in that file and is shared by every
+    process using the same path (POSIX only, the file is locked with flock).
+    """
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, calls_per_second=0, calls_per_month=0, burst=None, state_path=None):
+        if state_path is not None and fcntl is None:
+            raise classes.Error('Sharing a rate limiter across processes needs fcntl')
+        self.calls_per_second = float(calls_per_second or 0)
+        self.calls_per_month = int(calls_per_month or 0)
+        self.burst = float(burst or max(1.0, self.calls_per_second))
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = {'tokens': self.burst, 'updated': time.time(), 'month': None, 'calls': 0}
+
+    @classmethod
+    def for_key(cls, subscription_key, calls_per_second=0, calls_per_month=0,
+                burst=None, state_dir=None):
+        """
+        Returns the limiter shared by every session using the given subscription
+        key with the same limits. If state_dir is given, the state file of the
+        key is kept inside it.
+        """
+        state_path = None
+        if state_dir:
+            digest = hashlib.sha1(subscription_key.encode('utf-8')).hexdigest()
+            state_path = os.path.join(state_dir, 'maka-{}.rate'.format(digest[:16]))
+        config = (subscription_key, float(calls_per_second or 0), int(calls_per_month or 0),
+                  burst, state_path)
+        with cls._registry_lock:
+            limiter = cls._registry.get(config)
+            if limiter is None:
+                limiter = cls(calls_per_second, calls_per_month, burst, state_path)
+                cls._registry[config] = limiter
+            return limiter
+
+    def _update(self, state, now):
+        """
+        Takes one token and one call of the monthly budget from state.
+        Returns how long the caller must wait before sending its request.
+        """
+        month = time.strftime('%Y-%m', time.gmtime(now))
+        if state.get('month') != month:
+            state['month'] = month
+            state['calls'] = 0
+        if self.calls_per_month and state['calls'] >= self.calls_per_month:
+            raise classes.QuotaExceededError('Monthly quota of {} calls exhausted for {}'
+                                             .format(self.calls_per_month, month))
+        state['calls'] += 1
+        if not self.calls_per_second:
+            return 0.0
+        elapsed = max(0.0, now - state['updated'])
+        state['tokens'] = min(self.burst, state['tokens'] + elapsed * self.calls_per_second)
+        state['updated'] = now
+        state['tokens'] -= 1
+        if state['tokens'] >= 0:
+            return 0.0
+        return -state['tokens'] / self.calls_per_second
+
+    def reserve(self):
+        """
+        Reserves a call and returns the delay (in seconds) to wait before making it.
+        """
+        with self._lock:
+            now = time.time()
+            if self.state_path is None:
+                return self._update(self._state, now)
+            with open(self.state_path, 'a+') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    handle.seek(0)
+                    content = handle.read()
+                    state = json.loads(content) if content else dict(self._state)
+                    delay = self._update(state, now)
+                    handle.seek(0)
+                    handle.truncate()
+                    handle.write(json.dumps(state))
+                    handle.flush()
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+            return delay
+
+    def acquire(self):
+        """
+        Blocks the calling thread until a call is allowed.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """
+        Suspends the calling task until a call is allowed. A file-backed
+        reservation waits for the lock in a thread, off the event loop.
+        """
+        if self.state_path is None:
+            delay = self.reserve()
+        else:
+            delay = await asyncio.get_event_loop().run_in_executor(None, self.reserve)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class AcademicRetryPolicy(object):
+    """
+    Decides whether a failed request is retried and how long to wait before.
+    Delays follow a "full jitter" exponential backoff, but never fall
+    below the Retry-After value sent by the server.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_retries=5, backoff_base=0.5, backoff_max=60.0, statuses=None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.statuses = self.RETRY_STATUSES if statuses is None else tuple(statuses)
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Returns the seconds expressed by a Retry-After header, or None.
+        The header holds either a number of seconds or an HTTP date.
+        """
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when is None:
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Returns the delay before the retry following the given attempt (0-based).
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def next_delay(self, history, status_code, retry_after=None, reason=None):
+        """
+        Records a failed attempt in history and returns the delay before retrying.
+        A status_code of None means that no response was received.
+        Raises RequestError (or ThrottledError for 429) when the failure
+        is not transient or the retries are exhausted.
+        """
+        attempt = len(history)
+        delay = None
+        if (status_code is None or status_code in self.statuses) and attempt < self.max_retries:
+            delay = self.backoff(attempt, retry_after)
+        history.append({
+            'attempt': attempt + 1,
+            'status': status_code,
+            'reason': reason,
+            'retry_after': retry_after,
+            'delay': delay
+        })
+        if delay is not None:
+            return delay
+        if status_code is None:
+            msg = 'The request could not be sent after {} attempts: {}'.format(attempt + 1, reason)
+        else:
+            msg = ('An error ocurred while processing the request. Code: {} ({} attempts)'
+                   .format(status_code, attempt + 1))
+        if status_code == 429:
+            raise classes.ThrottledError(msg, status_code, history)
+        raise classes.RequestError(msg, status_code, history)
@@ -1,15 +1,11 @@
 """
 Test Module
 """
+import json
 import os
 import sys
-import json
 
 from os.path import join, dirname
-from random import randint
-from queue import Queue
-from threading import Thread
-from time import sleep
 from dotenv import load_dotenv
 from optparse import IndentedHelpFormatter, OptionGroup, OptionParser
 
@@ -17,84 +13,34 @@ dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path)
 
 try:
-    import maka.classes as classes
-    import maka.inquirer as inquirer
+    import maka.crawler as crawler
+    import maka.journal as journal
+    import maka.storage as storage
 except ImportError:
     import inspect
     CURRENT_DIR = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
     PARENT_DIR = os.path.dirname(CURRENT_DIR)
     os.sys.path.insert(0, PARENT_DIR)
-    import classes
-    import inquirer
+    import crawler
+    import journal
+    import storage
 
-DELAY = 1
 NUM_QUERIER_THREADS = 2
-ROOT = {'author': None, 'aliases': [], 'articles': []}
-THE_QUEUE = Queue()
+# Sinks for the articles of the author and for the papers citing them
+WRITERS = {}
 
-def find_article(article, parent=None):
-    if parent is not None:
-        for p in ROOT['articles']:
-            if p['id'] == parent and p['cites']:
-                 for art in p['cites']:
-                     if art['id'] == article:
-                         return art
-    else:
-        for art in ROOT['articles']:
-            if art['id'] == article:
-                return art
-    return None
+def save_entity(entity, task):
+    """
+    Saves a new paper found by the crawler, at depth 0 for the author's articles.
+    """
+    WRITERS['articles' if task.depth == 0 else 'citations'].write(entity)
 
-def querier_enclosure(i, q):
+def flush_writers():
     """
-    Wrapper for the query procedure in order to be used in a Worker
+    Flushes the papers saved so far, before the crawler journals them as seen.
     """
-    while True:
-        print('Worker {}: Looking for the next query'.format(i))
-        args = q.get()
-        query = inquirer.AcademicQuerier(args['query_type'], args['payload'])
-        if query is not None:
-            results = query.post()
-            if results:
-                if args['query_type'] == inquirer.AcademicQueryType.INTERPRET:
-                    expr = 'OR({})'.format(','.join([interpretation['rules'][0]['value']
-                                                     for interpretation in results]))
-                    THE_QUEUE.put({
-                        'query_type': inquirer.AcademicQueryType.EVALUATE,
-                        'payload':    {
-                            'expr':       expr,
-                            'attributes': '*'
-                        },
-                        'parent': None
-                    })
-                elif args['query_type'] == inquirer.AcademicQueryType.EVALUATE:
-                    parent = args.get('parent', None)
-                    branch = ROOT['articles'] if parent is None else (find_article(parent))['cites']
-                    for result in results:
-                        article = find_article(result['id'], parent)
-                        if article is None:
-                            branch.append(result)
-                            if parent is None:
-                                expr = 'RId={}'.format(result['id'])
-                                THE_QUEUE.put({
-                                    'query_type': inquirer.AcademicQueryType.EVALUATE,
-                                    'payload':    {
-                                        'expr':       expr,
-                                        'attributes': '*'
-                                    },
-                                    'parent': result['id']
-                                })
-                    total = len(branch)
-                    if total%50 == 0:
-                        new_payload = args['payload'].copy()
-                        new_payload['offset'] = total
-                        THE_QUEUE.put({
-                            'query_type': args['query_type'],
-                            'payload': new_payload,
-                            'parent': args['parent']
-                        })
-        q.task_done()
-        sleep(DELAY)
+    for writer in WRITERS.values():
+        writer.flush()
 
 def main():
     """
@@ -109,31 +55,59 @@ A command-line interface to Microsoft's Academic Knowledge."""
                                  'These options define search query arguments and parameters.')
     group.add_option('-a', '--author', metavar='AUTHORS', default=None,
                      help='Author name(s)')
+    group.add_option('-d', '--depth', metavar='HOPS', type='int', default=1,
+                     help='Levels of citing papers to crawl (default: 1)')
+    parser.add_option_group(group)
+    group = OptionGroup(parser, 'Output arguments',
+                        'These options define where and how the results are saved.')
+    group.add_option('-o', '--output', metavar='DIR', default=None,
+                     help='Output directory, named after the author by default')
+    group.add_option('-z', '--compression', metavar='ALGO', default=None,
+                     choices=['gzip', 'zstd'], help='Compress the shards with gzip or zstd')
+    group.add_option('-r', '--resume', action='store_true', default=False,
+                     help='Resume the interrupted crawl journaled in the output directory')
     parser.add_option_group(group)
     options, _ = parser.parse_args()
 
-    # Show help if we have no author name
-    if len(sys.argv) == 1:
+    # Show help if we have no author name, unless resuming from an output directory
+    if len(sys.argv) == 1 or (options.author is None and not (options.resume and options.output)):
         parser.print_help()
         return 1
     
-    for i in range(NUM_QUERIER_THREADS):
-        worker = Thread(target=querier_enclosure, args=(i, THE_QUEUE,))
-        worker.setDaemon(True)
-        worker.start()
+    output = options.output or options.author.replace(' ', '')
+    the_journal = journal.AcademicCrawlJournal(join(output, 'journal'))
+    if options.resume and not the_journal.exists():
+        print('*** Nothing to resume in {}'.format(output))
+        return 1
+    if not options.resume and os.path.isdir(output) and os.listdir(output):
+        # Shards of an earlier crawl would be mixed with the new ones
+        print('*** {} is not empty, resume the crawl or choose another directory'.format(output))
+        return 1
+    for name in ('articles', 'citations'):
+        WRITERS[name] = storage.AcademicJsonlWriter(output, prefix=name,
+                                                    compression=options.compression,
+                                                    resume=options.resume)
 
-    ROOT['author'] = options.author
-    THE_QUEUE.put({
-        'query_type': inquirer.AcademicQueryType.INTERPRET,
-        'payload': {
-           'query': 'papers by {}'.format(options.author)
-        }
-    })
+    the_crawler = crawler.AcademicCrawler(max_depth=options.depth, workers=NUM_QUERIER_THREADS,
+                                          on_entity=save_entity, journal=the_journal,
+                                          pre_commit=flush_writers)
+    seeds = []
+    if options.resume:
+        print('*** Resuming {} pending tasks'.format(the_crawler.resume()))
+    else:
+        the_journal.reset()
+        seeds.append(crawler.AcademicCrawlTask(
+            'interpret', {'query': 'papers by {}'.format(options.author)}))
     print('*** Main thread waiting')
-    THE_QUEUE.join()
-    with open('{}.json'.format(ROOT['author'].replace(' ', '')), 'w') as outfile:
-        json.dump(ROOT, outfile, cls=classes.AcademicEncoder, indent=4)
-    print('*** Done')
+    stats = the_crawler.run(seeds)
+    for writer in WRITERS.values():
+        writer.close()
+    with open(join(output, 'cites.json'), 'w') as output_file:
+        json.dump(dict((str(parent), sorted(children))
+                       for parent, children in the_crawler.children.items()), output_file)
+    print('*** {} papers, {} citations, {} failed tasks'.format(
+        stats['entities'], stats['citations'], stats['errors']))
+    print('*** Done, results saved in {}'.format(output))
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Micro-benchmarks for the parsers and entities of the library.
+They run offline over synthetic API responses.
+"""
+import gc
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from optparse import IndentedHelpFormatter, OptionGroup, OptionParser
+
+try:
+    import maka.abstracts as abstracts
+    import maka.classes as classes
+except ImportError:
+    import inspect
+    CURRENT_DIR = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+    PARENT_DIR = os.path.dirname(CURRENT_DIR)
+    os.sys.path.insert(0, PARENT_DIR)
+    import abstracts
+    import classes
+
+def make_entity(i):
+    """
+    Builds a synthetic evaluate entity, similar to one returned with attributes='*'.
+    """
+    return {
+        'logprob': -17.5,
+        'Id': 2000000000 + i,
+        'Ti': 'a study of synthetic paper number {}'.format(i),
+        'Y': 1900 + i % 120,
+        'D': '{}-01-01'.format(1900 + i % 120),
+        'CC': i % 500,
+        'AA': [{'AuN': 'author {}'.format(i + j), 'AuId': 1000 + i + j,
+                'AfN': 'institute {}'.format(j), 'AfId': 50 + j} for j in range(4)],
+        'F': [{'FN': 'field {}'.format(j), 'FId': 300 + j} for j in range(5)],
+        'J': {'JN': 'journal', 'JId': 77},
+        'RId': [2000000000 + k for k in range(i % 30)],
+        'W': ['synthetic', 'paper', 'number'],
+        'E': json.dumps({
+            'DN': 'A Study of Synthetic Paper Number {}'.format(i),
+            'S': [{'Ty': 1, 'U': 'http://example.org/{}'.format(i)}],
+            'VFN': 'Journal of Synthetic Results',
+            'V': 12, 'I': 3, 'FP': 1, 'LP': 10,
+            'DOI': '10.0000/{}'.format(i),
+            'IA': {'IndexLength': 40,
+                   'InvertedIndex': dict(('w{}'.format(k), [k, k + 20]) for k in range(20))}
+        })
+    }
+
+def bench_parse(entities, repeat):
+    """
+    Prints the parsing throughput of AcademicPaperParser.
+    """
+    timer = timeit.Timer(lambda: [classes.AcademicPaperParser.parse(e) for e in entities])
+    best = min(timer.repeat(repeat=repeat, number=1))
+    print('parse: {} entities in {:.4f}s ({:,.0f} entities/s)'
+          .format(len(entities), best, len(entities) / best))
+    timer = timeit.Timer(lambda: classes.AcademicPaperParser.parse_many(entities))
+    best = min(timer.repeat(repeat=repeat, number=1))
+    print('parse_many: {} entities in {:.4f}s ({:,.0f} entities/s)'
+          .format(len(entities), best, len(entities) / best))
+    timer = timeit.Timer(lambda: [(paper['Id'], paper['CC']) for paper in
+                                  [classes.AcademicPaperParser.parse(e, lazy=True)
+                                   for e in entities]])
+    best = min(timer.repeat(repeat=repeat, number=1))
+    print('lazy parse, reading Id and CC: {} entities in {:.4f}s ({:,.0f} entities/s)'
+          .format(len(entities), best, len(entities) / best))
+
+def bench_abstracts(entities, repeat):
+    """
+    Prints the throughput of rebuilding abstracts with a plain loop, as texts and as tokens.
+    """
+    papers = classes.AcademicPaperParser.parse_many(entities)
+
+    def rebuild(paper):
+        inverted = paper['E']['IA']
+        words = [None] * inverted['IndexLength']
+        for word, positions in inverted['InvertedIndex'].items():
+            for position in positions:
+                words[position] = word
+        return ' '.join(word for word in words if word is not None)
+
+    timer = timeit.Timer(lambda: [rebuild(paper) for paper in papers])
+    best = min(timer.repeat(repeat=repeat, number=1))
+    print('abstracts, loop: {} papers in {:.4f}s ({:,.0f} papers/s)'
+          .format(len(papers), best, len(papers) / best))
+    timer = timeit.Timer(lambda: abstracts.reconstruct_abstracts(papers))
+    best = min(timer.repeat(repeat=repeat, number=1))
+    print('abstracts, texts: {} papers in {:.4f}s ({:,.0f} papers/s)'
+          .format(len(papers), best, len(papers) / best))
+    timer = timeit.Timer(lambda: abstracts.reconstruct_abstracts(papers, tokens=True))
+    best = min(timer.repeat(repeat=repeat, number=1))
+    print('abstracts, tokens: {} papers in {:.4f}s ({:,.0f} papers/s)'
+          .format(len(papers), best, len(papers) / best))
+
+def bench_memory(count):
+    """
+    Prints the memory held by `count` parsed papers.
+    The raw responses are dropped as soon as each paper is parsed.
+    """
+    gc.collect()
+    tracemalloc.start()
+    papers = [classes.AcademicPaperParser.parse(make_entity(i)) for i in range(count)]
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('memory: {} papers hold {:,.1f} MiB ({:,.0f} bytes/paper)'
+          .format(len(papers), current / 2.0 ** 20, current / float(len(papers))))
+
+def main():
+    """
+    The method called when running this script
+    """
+    usage = """benchmark.py --entities 1000
+Offline benchmarks of the parsers of the library."""
+
+    fmt = IndentedHelpFormatter(max_help_position=50, width=100)
+    parser = OptionParser(usage=usage, formatter=fmt)
+    group = OptionGroup(parser, 'Benchmark arguments',
+                        'These options define the size of the synthetic workload.')
+    group.add_option('-n', '--entities', metavar='N', type='int', default=1000,
+                     help='Number of entities in the evaluate page')
+    group.add_option('-p', '--papers', metavar='P', type='int', default=100000,
+                     help='Number of papers kept in memory, 0 skips the memory benchmark')
+    group.add_option('-r', '--repeat', metavar='R', type='int', default=5,
+                     help='Number of repetitions, the best one is reported')
+    parser.add_option_group(group)
+    options, _ = parser.parse_args()
+
+    entities = [make_entity(i) for i in range(options.entities)]
+    bench_parse(entities, options.repeat)
+    bench_abstracts(entities, options.repeat)
+    if options.papers:
+        bench_memory(options.papers)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,25 +5,60 @@ from os.path import join, dirname
 from dotenv import load_dotenv
 from optparse import IndentedHelpFormatter, OptionGroup, OptionParser
 
-import matplotlib.pyplot as plt
-
 dotenv_path = join(dirname(__file__), '.env')
 load_dotenv(dotenv_path)
 
 try:
+    import maka.histograms as histograms
     import maka.inquirer as inquirer
 except ImportError:
     import inspect
     CURRENT_DIR = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
     PARENT_DIR = os.path.dirname(CURRENT_DIR)
     os.sys.path.insert(0, PARENT_DIR)
+    import histograms
     import inquirer
 
+def export(tables, output):
+    """
+    Saves each table as CSV, or as .npz when the output ends with it.
+    With several attributes, the attribute is added to the file name.
+    """
+    root, extension = os.path.splitext(output)
+    for attribute, table in tables.items():
+        path = output if len(tables) == 1 else '{}.{}{}'.format(root, attribute, extension)
+        if extension == '.npz':
+            table.save(path)
+        else:
+            table.to_csv(path)
+        print('{} values of {} for {} expressions saved in {}'
+              .format(len(table.values), attribute, len(table.expressions), path))
+
+def plot(histograms_list):
+    """
+    Shows a bar chart of each histogram.
+    """
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    for histogram in histograms_list:
+        data = histogram['data']
+        rng = range(1, len(data)+1)
+        labels = [val['value'] for val in data]
+        plt.bar(rng, [val['count'] for val in data])
+        plt.xticks(rng, labels, rotation='vertical')
+        plt.margins(0.2)
+        plt.subplots_adjust(bottom=0.15)
+        plt.legend()
+        plt.xlabel(histogram['attribute'])
+        plt.ylabel('count')
+        plt.title('Histogram for {}'.format(histogram['attribute']))
+        plt.show()
+
 def main():
     """
     The method called when running this script
     """
     usage = """calc_histogram.py --expr "expresion"
+       calc_histogram.py --file expressions.txt --attributes Y,F.FN --output histograms.csv
 A command-line tool to test similarity to Microsoft's Academic Knowledge."""
 
     fmt = IndentedHelpFormatter(max_help_position=50, width=100)
@@ -33,6 +68,14 @@ A command-line tool to test similarity to Microsoft's Academic Knowledge."""
                         'These options define search query arguments and parameters.')
     group.add_option('-e', '--expresion', metavar='EXPR', default=None, help='Expression')
     group.add_option('-a', '--attributes', metavar='ATTR', default='Id', help='Expression')
+    group.add_option('-f', '--file', metavar='FILE', default=None,
+                     help='Merge the histograms of every expression of a file, one per line')
+    group.add_option('-c', '--count', metavar='N', type='int', default=None,
+                     help='Number of most frequent values of each histogram')
+    group.add_option('-o', '--output', metavar='FILE', default=None,
+                     help='Save the merged histograms as CSV, or .npz, instead of plotting them')
+    group.add_option('-k', '--top', metavar='K', type='int', default=10,
+                     help='Number of most frequent values printed when merging')
     parser.add_option_group(group)
     options, _ = parser.parse_args()
 
@@ -40,29 +83,32 @@ A command-line tool to test similarity to Microsoft's Academic Knowledge."""
     if len(sys.argv) == 1:
         parser.print_help()
         return 1
+    if options.file is not None or options.output is not None:
+        expressions = [] if options.expresion is None else [options.expresion]
+        if options.file is not None:
+            with open(options.file) as input_file:
+                expressions.extend(line.strip() for line in input_file if line.strip())
+        engine = histograms.AcademicHistogramEngine(options.attributes, count=options.count)
+        tables = engine.run(expressions)
+        if options.output is not None:
+            export(tables, options.output)
+        else:
+            for attribute, table in tables.items():
+                print('{}: {}'.format(attribute, table.top(options.top)))
+        return 0
     if options.expresion is None:
         print('Expression is mandatory!')
         return 1
 
-    query = inquirer.AcademicQuerier(inquirer.AcademicQueryType.HISTOGRAM, {
+    arguments = {
         'expr': options.expresion,
         'attributes': options.attributes
-    })
+    }
+    if options.count is not None:
+        arguments['count'] = options.count
+    query = inquirer.AcademicQuerier(inquirer.AcademicQueryType.HISTOGRAM, arguments)
     if query is not None:
-        histograms = query.post()
-        for histogram in histograms:
-            data = histogram['data']
-            rng = range(1, len(data)+1)
-            labels = [val['value'] for val in data]
-            plt.bar(rng, [val['count'] for val in data])
-            plt.xticks(rng, labels, rotation='vertical')
-            plt.margins(0.2)
-            plt.subplots_adjust(bottom=0.15)
-            plt.legend()
-            plt.xlabel(histogram['attribute'])
-            plt.ylabel('count')
-            plt.title('Histogram for {}'.format(histogram['attribute']))
-            plt.show()
+        plot(query.post())
 
 if __name__ == '__main__':
     sys.exit(main())
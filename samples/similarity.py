@@ -10,18 +10,21 @@ load_dotenv(dotenv_path)
 
 try:
     import maka.inquirer as inquirer
+    import maka.pairwise as pairwise
 except ImportError:
     import inspect
     CURRENT_DIR = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
     PARENT_DIR = os.path.dirname(CURRENT_DIR)
     os.sys.path.insert(0, PARENT_DIR)
     import inquirer
+    import pairwise
 
 def main():
     """
     The method called when running this script
     """
     usage = """similarity.py --s1 "this is a test" --s2 "that was a test"
+       similarity.py --file titles.txt --output matrix.npz
 A command-line tool to test similarity to Microsoft's Academic Knowledge."""
 
     fmt = IndentedHelpFormatter(max_help_position=50, width=100)
@@ -31,6 +34,10 @@ A command-line tool to test similarity to Microsoft's Academic Knowledge."""
                         'These options define search query arguments and parameters.')
     group.add_option('--s1', metavar='STRING1', default=None, help='First string')
     group.add_option('--s2', metavar='STRING2', default=None, help='Second string')
+    group.add_option('-f', '--file', metavar='FILE', default=None,
+                     help='Compare every pair of lines of a file instead')
+    group.add_option('-o', '--output', metavar='FILE', default=None,
+                     help='Save the matrix of the pairs of lines as .npz instead of printing it')
     parser.add_option_group(group)
     options, _ = parser.parse_args()
 
@@ -38,6 +45,16 @@ A command-line tool to test similarity to Microsoft's Academic Knowledge."""
     if len(sys.argv) == 1:
         parser.print_help()
         return 1
+    if options.file is not None:
+        with open(options.file) as input_file:
+            texts = [line.strip() for line in input_file if line.strip()]
+        matrix = pairwise.similarity_matrix(texts, sparse=options.output is not None)
+        if options.output is not None:
+            matrix.save(options.output)
+            print('{} non-zero scores saved in {}'.format(matrix.nnz, options.output))
+        else:
+            print(matrix)
+        return 0
     if options.s1 is None or options.s2 is None:
         print('Both strings are mandatory!')
         return 1
@@ -0,0 +1,404 @@
+"""
+Storage of crawl results as JSON Lines shards.
+"""
+import gzip
+import json
+import mmap
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # pylint: disable-msg=C0103
+
+import classes
+import inquirer
+
+def _record_id(record):
+    """
+    Returns the id of a record: an Academic object, its as_dict() or a raw
+    API entity (keyed 'Id'), or None for a dict without an id.
+    """
+    if isinstance(record, classes.AcademicObject):
+        return record['id']
+    return record.get('id', record.get('Id'))
+
+class AcademicJsonlWriter(object):
+    """
+    Writes Academic objects (or plain JSON-serializable values) one per line
+    into JSON Lines shards named <prefix>-<number>.jsonl[.gz|.zst].
+    A shard is closed and a new one opened once max_shard_bytes of
+    uncompressed JSON were written to it, and every closed shard gets a
+    small <shard>.manifest.json describing it, with the ids (the 'id', or
+    'Id' of raw entities) of its first and last records. Buffered lines are flushed
+    every flush_interval seconds by a background thread, so a crash loses at
+    most that much output. Only one record is held in memory at a time.
+    With resume, shard numbers continue after the shards of the prefix
+    already in the directory instead of overwriting them, and the shards
+    left without a manifest by an interrupted writer are cut after their
+    last complete line.
+    The writer is thread-safe.
+    """
+    EXTENSIONS = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+    DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, directory, prefix='papers', compression=None,
+                 max_shard_bytes=None, flush_interval=5.0, resume=False):
+        if compression not in self.EXTENSIONS:
+            raise classes.FormatError('Unknown compression: {}'.format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise classes.Error('zstandard is required for zstd compression')
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_shard_bytes = max_shard_bytes or self.DEFAULT_SHARD_BYTES
+        self.flush_interval = flush_interval
+        self.encoder = classes.AcademicEncoder(separators=(',', ':'))
+        self.shards = []
+        self._first_number = 0
+        self._lock = threading.Lock()
+        self._handle = None
+        self._raw = None
+        self._shard = None
+        self._closed = False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if resume:
+            pattern = re.compile(r'^{}-(\d+){}$'.format(
+                re.escape(prefix), re.escape(self.EXTENSIONS[compression])))
+            matches = [match for match in map(pattern.match, os.listdir(directory)) if match]
+            for match in matches:
+                path = os.path.join(directory, match.group(0))
+                if not os.path.exists(path + '.manifest.json'):
+                    self._repair(path)
+            numbers = [int(match.group(1)) for match in matches]
+            self._first_number = max(numbers) + 1 if numbers else 0
+        self._stop = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _repair(self, path):
+        """
+        Cuts the torn last line, if any, of a shard which was not closed.
+        Compressed shards are decoded as far as possible and rewritten.
+        """
+        if self.compression is None:
+            with open(path, 'r+b') as shard:
+                end = shard.seek(0, os.SEEK_END)
+                while end > 0:
+                    start = max(0, end - 65536)
+                    shard.seek(start)
+                    newline = shard.read(end - start).rfind(b'\n')
+                    if newline >= 0:
+                        end = start + newline + 1
+                        break
+                    end = start
+                shard.truncate(end)
+            return
+        with open(path, 'rb') as raw:
+            if self.compression == 'gzip':
+                # unlike GzipFile, a decompressor returns what precedes the tear
+                data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(raw.read())
+            else:
+                data = bytearray()
+                stream = zstandard.ZstdDecompressor().stream_reader(raw)
+                try:
+                    for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                        data.extend(chunk)
+                except zstandard.ZstdError:
+                    pass
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as raw:
+            if self.compression == 'gzip':
+                stream = gzip.GzipFile(fileobj=raw, mode='wb')
+            else:
+                stream = zstandard.ZstdCompressor().stream_writer(raw)
+            stream.write(bytes(data[:data.rfind(b'\n') + 1]))
+            stream.close()
+        os.replace(temporary, path)
+
+    def _open_shard(self):
+        """
+        Opens the next shard. Must be called with the lock held.
+        """
+        number = self._first_number + len(self.shards)
+        name = '{}-{:05d}{}'.format(self.prefix, number, self.EXTENSIONS[self.compression])
+        path = os.path.join(self.directory, name)
+        self._raw = open(path, 'wb')
+        if self.compression == 'gzip':
+            self._handle = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        elif self.compression == 'zstd':
+            self._handle = zstandard.ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._handle = self._raw
+        self._shard = {
+            'shard': name,
+            'compression': self.compression,
+            'records': 0,
+            'bytes': 0,
+            'first_id': None,
+            'last_id': None,
+            'created': time.time()
+        }
+        self.shards.append(self._shard)
+
+    def _close_shard(self):
+        """
+        Closes the current shard and writes its manifest. Must be called with the lock held.
+        """
+        if self._handle is None:
+            return
+        self._handle.close()
+        if self._raw is not self._handle:
+            self._raw.close()
+        self._shard['closed'] = time.time()
+        self._shard['stored_bytes'] = os.path.getsize(
+            os.path.join(self.directory, self._shard['shard']))
+        path = os.path.join(self.directory, self._shard['shard'] + '.manifest.json')
+        with open(path, 'w') as manifest:
+            json.dump(self._shard, manifest, indent=4)
+        self._handle = self._raw = self._shard = None
+
+    def write(self, obj):
+        """
+        Appends one record.
+        """
+        line = (self.encoder.encode(obj) + '\n').encode('utf-8')
+        record_id = None
+        if isinstance(obj, (classes.AcademicObject, dict)):
+            record_id = _record_id(obj)
+        with self._lock:
+            if self._closed:
+                raise classes.Error('The writer is closed')
+            if self._handle is None:
+                self._open_shard()
+            self._handle.write(line)
+            self._shard['records'] += 1
+            self._shard['bytes'] += len(line)
+            if record_id is not None:
+                if self._shard['first_id'] is None:
+                    self._shard['first_id'] = record_id
+                self._shard['last_id'] = record_id
+            if self._shard['bytes'] >= self.max_shard_bytes:
+                self._close_shard()
+
+    def write_many(self, objs):
+        """
+        Appends every record of an iterable.
+        """
+        for obj in objs:
+            self.write(obj)
+
+    def flush(self, sync=False):
+        """
+        Pushes the buffered lines of the current shard to the operating
+        system, and to the disk when sync is set.
+        """
+        with self._lock:
+            if self._handle is not None:
+                self._handle.flush()
+                if self._raw is not self._handle:
+                    self._raw.flush()
+                if sync:
+                    os.fsync(self._raw.fileno())
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """
+        Closes the current shard and stops the background flushes.
+        Returns the manifests of every shard written.
+        """
+        self._stop.set()
+        with self._lock:
+            if not self._closed:
+                self._close_shard()
+                self._closed = True
+        return self.shards
+
+class AcademicJsonlReader(object):
+    """
+    Random access to the papers stored in uncompressed JSON Lines shards.
+    Every shard gets a sidecar <shard>.idx.npy index with the id, byte offset
+    and length of each record; it is built on first use and rebuilt when the
+    shard is newer. The indexes are merged into one id-sorted array, while
+    the shards stay memory-mapped and only the requested records are decoded
+    into AcademicPaper objects. When an id appears more than once, the first
+    record written wins.
+    """
+    INDEX_SUFFIX = '.idx.npy'
+    INDEX_DTYPE = np.dtype([('id', '<i8'), ('offset', '<u8'), ('length', '<u4')])
+
+    def __init__(self, paths, lazy=True):
+        """
+        Opens the shards given as a list of paths, or every *.jsonl file of a directory.
+        Papers are parsed lazily unless lazy is False.
+        """
+        if isinstance(paths, str):
+            if os.path.isdir(paths):
+                paths = sorted(os.path.join(paths, name) for name in os.listdir(paths)
+                               if name.endswith('.jsonl'))
+            else:
+                paths = [paths]
+        self.paths = list(paths)
+        self.lazy = lazy
+        self._files = []
+        self._maps = []
+        indexes = []
+        for number, path in enumerate(self.paths):
+            if not path.endswith('.jsonl'):
+                raise classes.FormatError('Only uncompressed .jsonl shards can be mapped: {}'
+                                          .format(path))
+            handle = open(path, 'rb')
+            self._files.append(handle)
+            size = os.fstat(handle.fileno()).st_size
+            self._maps.append(mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                              if size else b'')
+            index = self._load_index(number)
+            indexes.append(index)
+        # one global index sorted by id, remembering the shard of each record
+        if indexes:
+            self._index = np.concatenate(indexes)
+            self._shard = np.concatenate([np.full(len(index), number, dtype=np.int32)
+                                          for number, index in enumerate(indexes)])
+        else:
+            self._index = np.zeros(0, dtype=self.INDEX_DTYPE)
+            self._shard = np.zeros(0, dtype=np.int32)
+        self._order = np.argsort(self._index['id'], kind='stable')
+        self._ids = self._index['id'][self._order]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _load_index(self, number):
+        """
+        Returns the index of a shard, (re)building it if needed.
+        """
+        path = self.paths[number]
+        index_path = path + self.INDEX_SUFFIX
+        if (not os.path.exists(index_path)
+                or os.path.getmtime(index_path) < os.path.getmtime(path)):
+            np.save(index_path, self._build_index(number))
+        return np.load(index_path)
+
+    def _build_index(self, number):
+        """
+        Scans a shard and returns the id, offset and length of every record.
+        Lines which do not decode, like the unterminated last line left by
+        an interrupted writer, are skipped with a warning.
+        """
+        data = self._maps[number]
+        entries = []
+        offset = 0
+        size = len(data)
+        while offset < size:
+            end = data.find(b'\n', offset)
+            if end < 0:
+                inquirer.AcademicUtils.log('warn', 'Skipping the unterminated last line of {}'
+                                           .format(self.paths[number]))
+                break
+            if end > offset:
+                try:
+                    record_id = _record_id(json.loads(data[offset:end].decode('utf-8')))
+                except (ValueError, AttributeError):
+                    record_id = None
+                if record_id is None:
+                    inquirer.AcademicUtils.log('warn', 'Skipping the invalid line at offset {} of {}'
+                                               .format(offset, self.paths[number]))
+                else:
+                    entries.append((record_id, offset, end - offset))
+            offset = end + 1
+        return np.array(entries, dtype=self.INDEX_DTYPE)
+
+    def _decode(self, position):
+        """
+        Decodes the record at a position of the global index.
+        """
+        shard = self._shard[position]
+        entry = self._index[position]
+        start = int(entry['offset'])
+        line = self._maps[shard][start:start + int(entry['length'])]
+        return classes.AcademicPaperParser.parse(json.loads(line.decode('utf-8')), self.lazy)
+
+    def _positions(self, ids):
+        """
+        Returns the global index positions of ids, -1 for the missing ones.
+        """
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if not len(self._ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self._ids, ids), len(self._ids) - 1)
+        return np.where(self._ids[found] == ids, self._order[found], -1)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, paper_id):
+        return self._positions([paper_id])[0] >= 0
+
+    def get(self, paper_id):
+        """
+        Returns the paper with the given id, or None.
+        """
+        position = self._positions([paper_id])[0]
+        return None if position < 0 else self._decode(position)
+
+    def get_many(self, ids):
+        """
+        Returns the papers with the given ids, in the same order (None for missing ids).
+        Records are read in storage order to keep the accesses sequential.
+        """
+        positions = self._positions(ids)
+        papers = [None] * len(positions)
+        for i in np.argsort(positions, kind='stable'):
+            if positions[i] >= 0:
+                papers[i] = self._decode(positions[i])
+        return papers
+
+    def iter_papers(self, order='offset'):
+        """
+        Yields every paper, in storage ('offset') or in ascending 'id' order.
+        """
+        if order == 'offset':
+            positions = range(len(self._index))
+        elif order == 'id':
+            positions = self._order
+        else:
+            raise classes.FormatError('order must be either offset or id')
+        for position in positions:
+            yield self._decode(position)
+
+    def __iter__(self):
+        return self.iter_papers()
+
+    def close(self):
+        """
+        Unmaps and closes every shard.
+        """
+        for data in self._maps:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        for handle in self._files:
+            handle.close()
+        self._maps = []
+        self._files = []
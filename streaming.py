@@ -0,0 +1,114 @@
+"""
+Incremental decoding of large JSON responses.
+"""
+import codecs
+import json
+
+import classes
+
+_WHITESPACE = ' \t\n\r'
+
+class AcademicJSONStream(object):
+    """
+    Reads a JSON object from an iterable of text (or UTF-8 bytes) chunks and
+    yields the elements of one of its top-level arrays as soon as each of them
+    is complete. Only the element being decoded, plus the current chunk, are
+    held in memory; other top-level members are decoded and discarded.
+    """
+    # Consumed text is dropped from the buffer once it grows beyond this size
+    COMPACT_THRESHOLD = 64 * 1024
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        """
+        Appends the next chunk to the buffer. Returns False at the end of the input.
+        """
+        if self.eof:
+            return False
+        if self.pos > self.COMPACT_THRESHOLD:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                chunk = self.utf8.decode(chunk)
+            if chunk:
+                self.buffer += chunk
+                return True
+        self.buffer += self.utf8.decode(b'', final=True)
+        self.eof = True
+        return False
+
+    def _peek(self):
+        """
+        Skips whitespace and returns the next character, or '' at the end of the input.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ''
+
+    def _expect(self, chars):
+        """
+        Consumes the next character, which must be one of chars.
+        """
+        char = self._peek()
+        if not char or char not in chars:
+            raise classes.FormatError('Expected {!r} at offset {} of the JSON stream'
+                                      .format(chars, self.pos))
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """
+        Decodes the next complete JSON value.
+        A value ending exactly at the end of the buffer may be truncated
+        (e.g. a number), so it is only accepted once more input was read.
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self._read():
+                    continue
+                raise classes.FormatError('Truncated or invalid JSON stream at offset {}'
+                                          .format(self.pos))
+            if end == len(self.buffer) and self._read():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self, key):
+        """
+        Yields the elements of the top-level array stored under key.
+        Nothing is yielded if the key is missing or its value is not an array.
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name == key and self._peek() == '[':
+                self.pos += 1
+                if self._peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self._value()
+            if self._expect(',}') == '}':
+                return